@@ -0,0 +1,335 @@
+''' benchPRR: synthetic NextRequest exports and end-to-end oakPRR benchmarks
+
+	python benchPRR.py gen  dataDir/ NPRR [--seed S]
+	python benchPRR.py run  dataDir/ [--stages bldPRRdb,...] [--out bench.json] [--metrics] [--profile]
+
+210509: gen writes schema-faithful stand-ins for SD's API_data JSON exports
+	(PRRdb_json), SD's department lookup CSV and a matching requests CSV.
+	Everything is streamed so 10M PRR need no more memory than 10k.
+	run times each pipeline stage in its own spawned process and reports
+	wall time, rows/sec and that process's peak RSS
+'''
+
+import argparse
+import csv
+import datetime
+import json
+import multiprocessing
+import os
+import random
+import sqlite3 as sqlite
+import time
+
+import oakPRR
+
+## CONSTANTS
+
+SynthDeptFile = 'deptLookup.csv'
+SynthCSVFile = 'requests.csv'
+
+# (department name, SD normalized name); em-dash names exercise the CSV's mangled Finance em-dash
+SynthDepts = [
+	('Oakland Police Department','Police Department'),
+	('Finance — Revenue Management','Finance'),
+	('Finance — Accounting','Finance'),
+	('City Clerk','City Clerk'),
+	('City Attorney','City Attorney'),
+	('Public Works','Public Works'),
+	('Oakland Parks, Recreation & Youth Development','Parks and Rec'),
+	('Planning & Building','Planning and Building'),
+	('Human Resources Management','Human Resources'),
+	('Oakland Fire Department','Fire Department'),
+	('Transportation','Transportation'),
+	('Economic & Workforce Development','Economic and Workforce Development'),
+	('Housing & Community Development','Housing and Community Development'),
+	('Information Technology','Information Technology'),
+	('Mayor','Mayor'),
+	('City Administrator','City Administrator'),
+]
+
+SynthTopics = ['police report','incident report','body camera footage','911 call audio','emails',
+	'contracts','invoices','building permit','code enforcement complaint','budget documents',
+	'personnel records','meeting minutes','traffic collision report','fire inspection','payroll']
+SynthCloseReasons = [None,'Documents released','Redacted per law','No responsive documents',
+	'Request withdrawn','Duplicate request','Documents released;Redacted per law']
+SynthDocTitles = ['Report','Report (redacted)','Email thread','Redacted email','Invoice','Contract',
+	'Permit','Audio','Video','Minutes']
+SynthCompanies = [None,None,None,'N/A','Acme Inc.','Oakland Tribune','KQED','Law Offices of J. Doe',
+	'Bay City News','ACLU of Northern California']
+SynthEventTypes = 20
+SynthMsgTemplates = 10
+
+# 210509: benchStage names, in pipeline order
+BenchStages = ['bldPRRdb','anlyzRedact','bldIndexTblCSV','compdb2csv']
+
+## UTILITIES
+
+class JSONListWriter:
+	"write a JSON list one element at a time"
+
+	def __init__(self,outf):
+		self.outs = open(outf,'w')
+		self.outs.write('[')
+		self.n = 0
+
+	def add(self,elt):
+		self.outs.write((',\n' if self.n > 0 else '\n') + json.dumps(elt))
+		self.n += 1
+
+	def close(self):
+		self.outs.write('\n]\n')
+		self.outs.close()
+
+def nrTimestamp(dt):
+	"naive Oakland local datetime -> NextRequest timestamp, eg 2013-06-12T00:00:00.000-07:00"
+	tzinfo = oakPRR.oaklandTzinfo(dt.year,dt.month,dt.day,dt.hour)
+	return dt.replace(tzinfo=tzinfo).isoformat(timespec='milliseconds')
+
+def csvTimestamp(dt):
+	"naive Oakland local datetime -> requests CSV timestamp, eg 2/17/16 0:00"
+	return f'{dt.month}/{dt.day}/{dt.year % 100:02d} {dt.hour}:{dt.minute:02d}'
+
+## GENERATOR
+
+def genSynthPRR(dataDir,nprr,seed=0,firstYear=2015,lastYear=2021):
+	'''210509: write synthetic PRRdb_json exports, SynthDeptFile and SynthCSVFile into dataDir
+	PRR request dates uniform over [firstYear,lastYear]; ids and pretty_ids increase
+	with request date as in the real export.  ~1% of PRR are missing from the CSV,
+	~0.5% of CSV rows have no PRR and ~2% have a different department list
+	'''
+
+	rng = random.Random(seed)
+	os.makedirs(dataDir,exist_ok=True)
+	startTime = time.time()
+
+	with open(dataDir + SynthDeptFile,'w',newline='') as outs:
+		wrtr = csv.writer(outs)
+		wrtr.writerow(['id','name','name2','description','poc_id'])
+		for i,(name,normName) in enumerate(SynthDepts):
+			wrtr.writerow([i+1,name,normName,'',i+1])
+
+	def writeList(tblName,eltList):
+		wrtr = JSONListWriter(dataDir + oakPRR.PRRdb_json[tblName])
+		for elt in eltList:
+			wrtr.add(elt)
+		wrtr.close()
+
+	writeList('department',[{'id': i+1, 'name': name, 'description': ''} for i,(name,normName) in enumerate(SynthDepts)])
+	writeList('event_type',[{'id': i+1, 'name': f'event type {i+1}', 'state': 'active',
+							'display_on_request_timeline': i % 3 != 0, 'category': f'cat{i % 4}'}
+							for i in range(SynthEventTypes)])
+	writeList('message_templates',[{'id': i+1, 'name': f'template {i+1}', 'description': '',
+									'created_at': nrTimestamp(datetime.datetime(firstYear,1,1)),
+									'initial_contact': i == 0, 'category_id': str(i % 3)}
+									for i in range(SynthMsgTemplates)])
+
+	wrtrs = {tblName: JSONListWriter(dataDir + oakPRR.PRRdb_json[tblName])
+				for tblName in ('prr','event','document','note','depreq','notes_message_templates')}
+	csvOuts = open(dataDir + SynthCSVFile,'w',newline='',encoding='utf8')
+	csvWrtr = csv.writer(csvOuts)
+	csvWrtr.writerow(['Id','Created At','Request Date','Departments','Closed Date','Status',
+					'Request Text','Closure Reasons','URL','Requester Company'])
+
+	firstDay = datetime.datetime(firstYear,1,1)
+	spanSec = (datetime.datetime(lastYear+1,1,1) - firstDay).total_seconds()
+	# NB: sorted request times, so ids/pretty_ids follow request order
+	reqSecs = sorted(rng.random() * spanSec for i in range(nprr)) if nprr <= 10**6 else None
+	yearCount = {}
+	nid = {tblName: 0 for tblName in wrtrs}
+	reqSec = 0.
+
+	for prrIdx in range(1,nprr+1):
+		if reqSecs != None:
+			reqSec = reqSecs[prrIdx-1]
+		else:
+			# NB: sorted uniform draws without holding them: exponential gaps
+			reqSec = min(spanSec - 60, reqSec + rng.expovariate(nprr / spanSec))
+		reqDate = firstDay + datetime.timedelta(seconds=int(reqSec))
+		year = reqDate.year
+		yearCount[year] = yearCount.get(year,0) + 1
+		pretty_id = f'{year % 100:02d}-{yearCount[year]}'
+
+		createDate = reqDate + datetime.timedelta(seconds=rng.randint(0,3600)) if rng.random() < 0.9 else reqDate
+		dueDate = reqDate + datetime.timedelta(days=10)
+		closed = rng.random() < 0.85
+		closeDate = reqDate + datetime.timedelta(days=rng.expovariate(1/30.), seconds=rng.randint(0,86400)) if closed else None
+		contactDate = reqDate + datetime.timedelta(days=rng.randint(0,5),seconds=rng.randint(0,36000))
+		lastDate = closeDate if closed else contactDate
+		topic = rng.choice(SynthTopics)
+		closeReason = rng.choice(SynthCloseReasons) if closed else None
+		ndept = 0 if rng.random() < 0.05 else (1 if rng.random() < 0.8 else rng.randint(2,3))
+		deptIdxList = rng.sample(range(1,len(SynthDepts)+1),ndept)
+
+		nid['prr'] += 1
+		wrtrs['prr'].add({
+			'id': prrIdx,
+			'pretty_id': pretty_id,
+			'created_at': nrTimestamp(createDate) if rng.random() > 0.001 else None,
+			'updated_at': nrTimestamp(lastDate),
+			'request_text': f'Requesting {topic} for {reqDate:%B %Y} regarding case {rng.randint(1000,99999)}',
+			'request_date': nrTimestamp(reqDate),
+			'due_date': nrTimestamp(dueDate),
+			'closed_date': nrTimestamp(closeDate) if closed else None,
+			'publish_date': nrTimestamp(closeDate) if closed and rng.random() < 0.5 else None,
+			'visibility': 'public' if rng.random() < 0.9 else 'private',
+			'closure_reasons': closeReason,
+			'state': 'Closed' if closed else rng.choice(['Open','Overdue']),
+			'initial_contact_date': nrTimestamp(contactDate),
+			'initial_contact_event_id': None,
+			'poc_id': rng.randint(1,200),
+			'account_id': 90,
+			'general_report_response_days': rng.randint(1,10),
+			'ever_overdue': closed and closeDate > dueDate,
+		})
+
+		for deptIdx in deptIdxList:
+			nid['depreq'] += 1
+			wrtrs['depreq'].add({'id': nid['depreq'], 'request_id': prrIdx, 'department_id': deptIdx,
+								'deleted': rng.random() < 0.02})
+
+		for i in range(rng.randint(1,8)):
+			nid['event'] += 1
+			evDate = reqDate + datetime.timedelta(hours=rng.randint(0,24*40))
+			wrtrs['event'].add({'id': nid['event'], 'request_id': prrIdx,
+								'event_type_id': rng.randint(1,SynthEventTypes), 'subject_user_id': rng.randint(1,200),
+								'description': rng.choice(['','Request opened','Document(s) released','Due date extended']),
+								'created_at': nrTimestamp(evDate), 'updated_at': nrTimestamp(evDate),
+								'byline': 'Staff', 'state': 'public', 'account_id': 90, 'deleted': rng.random() < 0.01})
+
+		for i in range(rng.randint(0,6) if closed else 0):
+			nid['document'] += 1
+			title = rng.choice(SynthDocTitles)
+			wrtrs['document'].add({'id': nid['document'], 'title': title, 'url': f'/documents/{nid["document"]}',
+								'description': '', 'created_at': nrTimestamp(closeDate), 'updated_at': nrTimestamp(closeDate),
+								'count': rng.randint(1,50), 'doc_date': None, 'link': False, 'requester_upload': False,
+								'state': 'public', 'filename': f'{title.lower().replace(" ","_")}.pdf',
+								# NB: a few documents with no PRR, as in docID-missPRR.csv
+								'request_id': prrIdx if rng.random() > 0.002 else None,
+								'review_state': 'approved', 'account_id': 90,
+								'attachment_via_email': False, 'original_doc_link': None})
+
+		for i in range(rng.randint(0,3)):
+			nid['note'] += 1
+			noteDate = reqDate + datetime.timedelta(hours=rng.randint(0,24*30))
+			wrtrs['note'].add({'id': nid['note'], 'note_text': f'Contacted {rng.choice(SynthDepts)[0]} about {topic}',
+								'created_at': nrTimestamp(noteDate), 'updated_at': nrTimestamp(noteDate),
+								'request_id': prrIdx, 'email': rng.random() < 0.3, 'deleted': False,
+								'user_id': rng.randint(1,200), 'state': 'public', 'account_id': 90})
+			if rng.random() < 0.2:
+				nid['notes_message_templates'] += 1
+				wrtrs['notes_message_templates'].add({'id': nid['notes_message_templates'], 'note_id': nid['note'],
+								'message_template_id': rng.randint(1,SynthMsgTemplates), 'created_at': nrTimestamp(noteDate)})
+
+		if rng.random() < 0.01:
+			continue
+		csvDepts = [SynthDepts[deptIdx-1][0] for deptIdx in deptIdxList]
+		if rng.random() < 0.02:
+			csvDepts = [rng.choice(SynthDepts)[0]]
+		# NB: the export mangles Finance's em-dash
+		csvDepts = [dept.replace('—','�') if dept.startswith('Finance') else dept for dept in csvDepts]
+		csvRows = [pretty_id] if rng.random() > 0.005 else [pretty_id, f'{pretty_id}x']
+		for csvID in csvRows:
+			company = rng.choice(SynthCompanies)
+			csvWrtr.writerow([csvID,csvTimestamp(createDate),csvTimestamp(reqDate),';'.join(csvDepts),
+							csvTimestamp(closeDate) if closed else '','Closed' if closed else 'Open',
+							f'Requesting {topic}',closeReason or '',
+							f'https://oaklandca.nextrequest.com/requests/{pretty_id}',company or ''])
+
+	for wrtr in wrtrs.values():
+		wrtr.close()
+	csvOuts.close()
+
+	elapsed = time.time() - startTime
+	print(f'genSynthPRR: {dataDir} NPRR={nprr} '+' '.join(f'N{tblName}={n}' for tblName,n in nid.items() if tblName != 'prr') +
+		f' {elapsed:.1f} sec')
+
+## BENCHMARK
+
+def benchStage(stage,dataDir,resultQ,metrics=False,profile=False):
+	'''210509: run one stage against dataDir in this (fresh) process
+	puts {stage,wall,rows,rowsPerSec,peakRSSMB} on resultQ
+	210510: metrics: oakPRR stage metrics to bench_out/<stage>.metrics.json,
+		profile: cProfile to bench_out/<stage>.prof
+	'''
+
+	oakPRR.DeptTbl_SD = oakPRR.loadDept_SD(dataDir + SynthDeptFile)
+	dbfile = dataDir + 'prr.db'
+	outDir = dataDir + 'bench_out/'
+	os.makedirs(outDir,exist_ok=True)
+	if metrics or profile:
+		oakPRR.startMetrics(outDir + f'{stage}.metrics.json',outDir + f'{stage}.prof' if profile else None)
+
+	startTime = time.time()
+	if stage == 'bldPRRdb':
+		oakPRR.bldPRRdb(dataDir)
+	elif stage == 'anlyzRedact':
+		oakPRR.anlyzRedact(sqlite.connect(dbfile),outDir)
+	elif stage == 'bldIndexTblCSV':
+		prrTbl = oakPRR.bldIndexTblCSV(dataDir + SynthCSVFile,useCache=False)
+	elif stage == 'compdb2csv':
+		oakPRR.compdb2csv(sqlite.connect(dbfile),oakPRR.iterIndexTblCSV(dataDir + SynthCSVFile),outDir + 'db2csvComp.csv')
+	else:
+		raise ValueError(f'benchStage: unknown stage {stage}')
+	elapsed = time.time() - startTime
+	oakPRR.stopMetrics()
+
+	# rows: all loaded rows for bldPRRdb, PRR for analyses
+	curs = sqlite.connect(dbfile).cursor()
+	if stage == 'bldPRRdb':
+		nrow = sum(curs.execute(f'select count(*) from {tblName}').fetchone()[0] for tblName in oakPRR.PRRdb_fields)
+	elif stage == 'bldIndexTblCSV':
+		nrow = len(prrTbl)
+	else:
+		nrow = curs.execute('select count(*) from prr').fetchone()[0]
+
+	resultQ.put({'stage': stage, 'wall': elapsed, 'rows': nrow,
+				'rowsPerSec': nrow / elapsed if elapsed > 0 else 0., 'peakRSSMB': oakPRR.peakRSSMB()})
+
+def runBench(dataDir,stages=BenchStages,outf=None,metrics=False,profile=False):
+	'''210509: benchStage each of stages in order, each in its own spawned process
+	so peak RSS is per stage; print a summary table, optionally write it to outf as JSON
+	'''
+
+	ctx = multiprocessing.get_context('spawn')
+	resultQ = ctx.Queue()
+	results = []
+	for stage in stages:
+		proc = ctx.Process(target=benchStage,args=(stage,dataDir,resultQ,metrics,profile))
+		proc.start()
+		proc.join()
+		if proc.exitcode != 0:
+			print(f'runBench: {stage} failed, exitcode={proc.exitcode}?!')
+			break
+		results.append(resultQ.get())
+
+	print(f'\nrunBench: {dataDir}')
+	print(f'{"Stage":16s} {"Wall(s)":>9s} {"Rows":>11s} {"Rows/s":>11s} {"PeakRSS(MB)":>12s}')
+	for res in results:
+		print(f'{res["stage"]:16s} {res["wall"]:9.2f} {res["rows"]:11d} {res["rowsPerSec"]:11.0f} {res["peakRSSMB"]:12.1f}')
+
+	if outf != None:
+		with open(outf,'w') as outs:
+			json.dump(results,outs,indent=1)
+
+	return results
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='synthetic NextRequest data and oakPRR benchmarks')
+	subParsers = parser.add_subparsers(dest='cmd',required=True)
+	genParser = subParsers.add_parser('gen',help='write synthetic exports')
+	genParser.add_argument('dataDir')
+	genParser.add_argument('nprr',type=int)
+	genParser.add_argument('--seed',type=int,default=0)
+	runParser = subParsers.add_parser('run',help='benchmark pipeline stages')
+	runParser.add_argument('dataDir')
+	runParser.add_argument('--stages',default=','.join(BenchStages))
+	runParser.add_argument('--out',default=None)
+	runParser.add_argument('--metrics',action='store_true',help='per-stage oakPRR metrics JSON in bench_out/')
+	runParser.add_argument('--profile',action='store_true',help='per-stage cProfile dumps in bench_out/')
+	args = parser.parse_args()
+
+	dataDir = os.path.join(args.dataDir,'')
+	if args.cmd == 'gen':
+		genSynthPRR(dataDir,args.nprr,args.seed)
+	else:
+		runBench(dataDir,args.stages.split(','),args.out,args.metrics,args.profile)
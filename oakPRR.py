@@ -5,15 +5,36 @@ Created on Mar 25, 2021
 '''
 
 from collections import defaultdict
+from collections.abc import Mapping
+import atexit
+import contextlib
+import cProfile
 import csv
 import datetime
+import functools
+import hashlib
+import itertools
 import json
 import math
+import multiprocessing
+import numpy as np
+import operator
 import os
+import pickle
 import pytz
+import queue
 import re
 import sqlite3 as sqlite
 import sys
+import time
+import traceback
+import zlib
+
+try:
+	import resource
+except ImportError:
+	# NB: not on Windows; peakRSSMB() reports 0
+	resource = None
 
 ## CONSTANTS
 
@@ -165,37 +186,571 @@ PRRdb_fields = {
 	
 }
 
+# 210425: date fields also stored as UTC epoch seconds plus (local) year and month
+# columns <fld>_epoch, <fld>_year, <fld>_month, so analyses can filter/bucket in SQL
+PRRdb_epochFlds = {
+	'prr': ['request_date','created_at','closed_date','due_date'],
+	'event': ['created_at'],
+	'note': ['created_at'],
+	'document': ['created_at']
+}
+
+# 210428: text columns covered by <tbl>_fts full-text (FTS5) indices
+PRRdb_ftsFlds = {
+	'prr': ['request_text'],
+	'note': ['note_text'],
+	'document': ['title','description']
+}
+
+# 210424: NextRequest JSON export feeding each table
+PRRdb_json = {
+	'prr': 'OakPRR_all.json',
+	'event': 'events.json',
+	'note': 'notes.json',
+	'document': 'documents.json',
+	'department': 'departments.json',
+	'depreq': 'departments_requests.json',
+	'event_type': 'event_types.json',
+	'message_templates': 'message_templates.json',
+	'notes_message_templates': 'notes_message_templates.json'
+}
+
+# bldPRRdb's insertion order
+PRRdb_loadOrder = ['prr','event','document','note','department','depreq',
+				   'event_type','message_templates','notes_message_templates']
+
+# tables filtered by request_id of PRR kept in the prr pass
+PRRdb_childTbls = ['event','document','note','depreq']
+
 ## UTILITIES
 
+# 210507: memoized parsers for the two fixed timestamp formats
+DateMemoSize = 2**16
+
+@functools.lru_cache(maxsize=DateMemoSize)
+def parseNRDate(dateStr):
+	'''NextRequest timestamp (NRDTformat) -> tz-aware datetime, as strptime
+	fromisoformat fast path; strptime for anything it rejects (eg Z suffix)
+	'''
+	try:
+		return datetime.datetime.fromisoformat(dateStr)
+	except ValueError:
+		return datetime.datetime.strptime(dateStr,NRDTformat)
+
+@functools.lru_cache(maxsize=DateMemoSize)
+def oaklandDayTzinfo(year,month,day):
+	"OaklandTimeZone tzinfo (PST/PDT) for a local day, None on DST switch days"
+	tz0 = OaklandTimeZone.localize(datetime.datetime(year,month,day,0)).tzinfo
+	tz23 = OaklandTimeZone.localize(datetime.datetime(year,month,day,23)).tzinfo
+	return tz0 if tz0 is tz23 else None
+
+def oaklandTzinfo(year,month,day,hour):
+	"OaklandTimeZone tzinfo in effect for local hour; DST switches on the hour"
+	dayTz = oaklandDayTzinfo(year,month,day)
+	if dayTz != None:
+		return dayTz
+	return OaklandTimeZone.localize(datetime.datetime(year,month,day,hour)).tzinfo
+
+@functools.lru_cache(maxsize=DateMemoSize)
+def parseCSVDate(dateStr):
+	'''CSV timestamp (CSVDTFormat2, eg 2/17/16 0:00) -> datetime localized to
+	OaklandTimeZone (plain replace(tzinfo=OaklandTimeZone) would give its LMT offset)
+	'''
+	try:
+		dayStr,timeStr = dateStr.split(' ')
+		month,day,year = dayStr.split('/')
+		hour,minute = timeStr.split(':')
+		if len(year) != 2:
+			raise ValueError(dateStr)
+		# NB: same century pivot as strptime %y
+		year = int(year)
+		year += 1900 if year >= 69 else 2000
+		dt = datetime.datetime(year,int(month),int(day),int(hour),int(minute))
+	except ValueError:
+		dt = datetime.datetime.strptime(dateStr,CSVDTFormat2)
+	return dt.replace(tzinfo=oaklandTzinfo(dt.year,dt.month,dt.day,dt.hour))
+
+def benchDateParse(dateStrs,nrep=5):
+	'''210507: microbenchmark parseNRDate/parseCSVDate against strptime
+	dateStrs: list of timestamps all in NRDTformat or all in CSVDTFormat2
+	'''
+
+	if 'T' in dateStrs[0]:
+		fastFn = parseNRDate
+		slowFn = lambda s: datetime.datetime.strptime(s,NRDTformat)
+	else:
+		fastFn = parseCSVDate
+		slowFn = lambda s: OaklandTimeZone.localize(datetime.datetime.strptime(s,CSVDTFormat2))
+
+	for s in dateStrs:
+		if fastFn(s) != slowFn(s):
+			print(f'benchDateParse: mismatch {s} {fastFn(s)} {slowFn(s)}?!')
+
+	ndistinct = len(set(dateStrs))
+	for name,fn in (('strptime',slowFn),('fast',fastFn.__wrapped__),('memo',fastFn)):
+		bestTime = None
+		for rep in range(nrep):
+			fastFn.cache_clear()
+			oaklandDayTzinfo.cache_clear()
+			startTime = time.perf_counter()
+			for s in dateStrs:
+				fn(s)
+			elapsed = time.perf_counter() - startTime
+			bestTime = elapsed if bestTime == None else min(bestTime,elapsed)
+		print(f'benchDateParse: {name:8s} N={len(dateStrs)} NDistinct={ndistinct} {1e6*bestTime/len(dateStrs):.2f} usec/date')
+
 def basicStats(l):
-	"Returns avg and stdev"
+	'''Returns avg and stdev
+	210430: population stdev (was sqrt(sumDiffSq)/n); see groupStats for grouped columns
+	'''
 	if len(l) == 0:
 		return(0.,0.)
 
-	tot = 0
-	for n in l:
-		tot += n
-	avg = float(tot) / len(l)
+	vals = np.asarray(l,dtype=float)
+	return (float(vals.mean()),float(vals.std()))
 
-	sumDiffSq = 0.
-	for n in l:
-		sumDiffSq += (n-avg)*(n-avg)
+# 210430: groupStats result for a group with no values, as basicStats
+EmptyStats = {'n': 0, 'mean': 0., 'stdev': 0., 'p50': 0., 'p90': 0.}
 
-	stdev = math.sqrt(sumDiffSq) / float(len(l))
-	return (avg,stdev)
+def groupStats(keyCols,values,pctList=(50,90),ddof=0):
+	'''210430: n, mean, stdev and percentiles of values per group, over whole columns at once
+	keyCols: list of equal-length key columns, eg [deptCol,yearCol]; key values must be sortable
+	pctList: percentiles reported as 'p<pct>' (linear interpolation, as numpy.percentile)
+	returns {keyTuple: {'n','mean','stdev','p50','p90',...}}
+	NB: per-group sums accumulate in input order, so means match summing a python list
+	'''
 
-def initPRRdb(currDB):
+	values = np.asarray(values,dtype=float)
+	if len(values) == 0:
+		return {}
+
+	# encode each key column, then combine into one integer group code
+	codes = np.zeros(len(values),dtype=np.int64)
+	levelList = []
+	for col in keyCols:
+		levels,inv = np.unique(np.asarray(col),return_inverse=True)
+		codes = codes * len(levels) + inv.reshape(-1)
+		levelList.append(levels)
+	groupCodes,ginv = np.unique(codes,return_inverse=True)
+	ginv = ginv.reshape(-1)
+
+	n = np.bincount(ginv)
+	mean = np.bincount(ginv,weights=values) / n
+	dev = values - mean[ginv]
+	dof = np.maximum(n - ddof,1)
+	stdev = np.sqrt(np.bincount(ginv,weights=dev*dev) / dof)
+
+	# percentiles from each group's sorted run
+	sortVals = values[np.lexsort((values,ginv))]
+	starts = np.cumsum(n) - n
+	pctTbl = {}
+	for pct in pctList:
+		pos = starts + (n - 1) * (pct / 100.)
+		lo = np.floor(pos).astype(np.int64)
+		hi = np.ceil(pos).astype(np.int64)
+		pctTbl[f'p{pct}'] = sortVals[lo] + (sortVals[hi] - sortVals[lo]) * (pos - lo)
+
+	# decode group codes back to key tuples
+	keyParts = []
+	rem = groupCodes.copy()
+	for levels in reversed(levelList):
+		keyParts.append(levels[rem % len(levels)].tolist())
+		rem = rem // len(levels)
+	keyList = list(zip(*reversed(keyParts)))
+
+	statTbl = {}
+	for gi,key in enumerate(keyList):
+		stats = {'n': int(n[gi]), 'mean': float(mean[gi]), 'stdev': float(stdev[gi])}
+		for pctName,pctVals in pctTbl.items():
+			stats[pctName] = float(pctVals[gi])
+		statTbl[key] = stats
+	return statTbl
+
+class RunningStats:
+	'''210430: streaming (Welford) count/mean/variance/min/max, for data that
+	doesn't fit in memory; add() single values, addArray() numpy chunks,
+	merge() accumulators from other partitions (Chan et al)
+	'''
+
+	def __init__(self):
+		self.n = 0
+		self.mean = 0.
+		self.m2 = 0.
+		self.min = None
+		self.max = None
+
+	def add(self,x):
+		self.n += 1
+		delta = x - self.mean
+		self.mean += delta / self.n
+		self.m2 += delta * (x - self.mean)
+		self.min = x if self.min == None else min(self.min,x)
+		self.max = x if self.max == None else max(self.max,x)
+
+	def addArray(self,arr):
+		arr = np.asarray(arr,dtype=float)
+		if len(arr) == 0:
+			return
+		chunk = RunningStats()
+		chunk.n = len(arr)
+		chunk.mean = float(arr.mean())
+		chunk.m2 = float(((arr - chunk.mean)**2).sum())
+		chunk.min = float(arr.min())
+		chunk.max = float(arr.max())
+		self.merge(chunk)
+
+	def merge(self,other):
+		if other.n == 0:
+			return
+		if self.n == 0:
+			(self.n,self.mean,self.m2,self.min,self.max) = (other.n,other.mean,other.m2,other.min,other.max)
+			return
+		n = self.n + other.n
+		delta = other.mean - self.mean
+		self.mean += delta * other.n / n
+		self.m2 += other.m2 + delta * delta * self.n * other.n / n
+		self.n = n
+		self.min = min(self.min,other.min)
+		self.max = max(self.max,other.max)
+
+	def variance(self,ddof=0):
+		return self.m2 / (self.n - ddof) if self.n > ddof else 0.
+
+	def stdev(self,ddof=0):
+		return math.sqrt(self.variance(ddof))
+
+class TDigest:
+	'''210501: merging t-digest (Dunning) approximate quantile sketch
+	memory fixed by compression (~compression/2 centroids, plus an add() buffer);
+	digests merge losslessly enough to roll up cells and time windows,
+	and round-trip through toBytes/fromBytes for SQLite BLOB storage
+	'''
+
+	def __init__(self,compression=100):
+		self.compression = compression
+		self.means = np.zeros(0)
+		self.weights = np.zeros(0)
+		self.min = None
+		self.max = None
+		self.buf = []
+
+	def kScale(self,q):
+		return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+	def qLimit(self,k):
+		"inverse of kScale, clamped to q=1"
+		if k >= self.compression / 4:
+			return 1.
+		return (math.sin(2 * math.pi * k / self.compression) + 1) / 2
+
+	def add(self,x):
+		self.buf.append(x)
+		if len(self.buf) >= 5 * self.compression:
+			self.compress()
+
+	def addArray(self,arr):
+		self.compress()
+		arr = np.asarray(arr,dtype=float)
+		if len(arr) > 0:
+			self.mergeCentroids(arr,np.ones(len(arr)),float(arr.min()),float(arr.max()))
+
+	def merge(self,other):
+		other.compress()
+		self.compress()
+		if other.count() > 0:
+			self.mergeCentroids(other.means,other.weights,other.min,other.max)
+
+	def compress(self):
+		if len(self.buf) == 0:
+			return
+		bufArr = np.asarray(self.buf,dtype=float)
+		self.buf = []
+		self.mergeCentroids(bufArr,np.ones(len(bufArr)),float(bufArr.min()),float(bufArr.max()))
+
+	def mergeCentroids(self,means,weights,newMin,newMax):
+		self.min = newMin if self.min == None else min(self.min,newMin)
+		self.max = newMax if self.max == None else max(self.max,newMax)
+
+		means = np.concatenate((self.means,means))
+		weights = np.concatenate((self.weights,weights))
+		order = np.argsort(means,kind='mergesort')
+		means = means[order].tolist()
+		weights = weights[order].tolist()
+		total = sum(weights)
+
+		newMeans = []
+		newWeights = []
+		curMean = means[0]
+		curW = weights[0]
+		wSoFar = 0.
+		qLimit = self.qLimit(self.kScale(0.) + 1.)
+		for m,w in zip(means[1:],weights[1:]):
+			if (wSoFar + curW + w) / total <= qLimit:
+				curW += w
+				curMean += (m - curMean) * w / curW
+			else:
+				newMeans.append(curMean)
+				newWeights.append(curW)
+				wSoFar += curW
+				qLimit = self.qLimit(self.kScale(wSoFar / total) + 1.)
+				curMean = m
+				curW = w
+		newMeans.append(curMean)
+		newWeights.append(curW)
+
+		self.means = np.array(newMeans)
+		self.weights = np.array(newWeights)
+
+	def count(self):
+		return float(self.weights.sum()) + len(self.buf)
+
+	def quantile(self,q):
+		"approximate q-quantile (0<=q<=1); None if empty"
+		self.compress()
+		n = self.count()
+		if n == 0:
+			return None
+		centers = np.cumsum(self.weights) - self.weights / 2
+		xs = np.concatenate(([0.],centers,[n]))
+		ys = np.concatenate(([self.min],self.means,[self.max]))
+		return float(np.interp(q * n,xs,ys))
+
+	def toBytes(self):
+		self.compress()
+		hdr = [self.compression,
+			   self.min if self.min != None else np.nan,
+			   self.max if self.max != None else np.nan]
+		return np.concatenate((hdr,self.means,self.weights)).astype('<f8').tobytes()
+
+	@staticmethod
+	def fromBytes(blob):
+		arr = np.frombuffer(blob,dtype='<f8')
+		digest = TDigest(float(arr[0]))
+		if not np.isnan(arr[1]):
+			digest.min = float(arr[1])
+			digest.max = float(arr[2])
+		ncent = (len(arr) - 3) // 2
+		digest.means = arr[3:3+ncent].copy()
+		digest.weights = arr[3+ncent:].copy()
+		return digest
+
+def iterJSONList(jfile,bufSize=2**16):
+	'''210420: yield elements of a top-level JSON array one at a time;
+	only bufSize characters (plus the current element) are held in memory
+	'''
+
+	decoder = json.JSONDecoder()
+	wsPat = re.compile(r'\s*')
+	sepPat = re.compile(r'[\s,]*')
+	numTailPat = re.compile(r'[0-9.eE+-]*')
+
+	with open(jfile,encoding='utf8') as inStr:
+		buf = ''
+		pos = 0
+		eof = False
+
+		def more():
+			nonlocal buf,pos,eof
+			chunk = inStr.read(bufSize)
+			if chunk == '':
+				eof = True
+			buf = buf[pos:] + chunk
+			pos = 0
+
+		while True:
+			pos = wsPat.match(buf,pos).end()
+			if pos < len(buf):
+				break
+			if eof:
+				raise ValueError(f'iterJSONList: empty file {jfile}?!')
+			more()
+
+		if buf[pos] != '[':
+			raise ValueError(f'iterJSONList: {jfile} not a JSON list?!')
+		pos += 1
+
+		while True:
+			pos = sepPat.match(buf,pos).end()
+			if pos == len(buf):
+				if eof:
+					raise ValueError(f'iterJSONList: {jfile} truncated?!')
+				more()
+				continue
+
+			if buf[pos] == ']':
+				break
+
+			try:
+				elem,end = decoder.raw_decode(buf,pos)
+			except json.JSONDecodeError:
+				if eof:
+					raise
+				more()
+				continue
+
+			# NB: a scalar whose lexeme runs to buffer end (eg `1.` or `1e`)
+			# may continue in next chunk; containers and strings are self-delimiting
+			if buf[pos] not in '[{"' and numTailPat.match(buf,end).end() == len(buf) and not eof:
+				more()
+				continue
+
+			pos = end
+			yield elem
+
+def loadJSONList(jfile,streamJSON=True):
+	"Returns iterator over top-level JSON array, streamed or fully decoded"
+	if streamJSON:
+		return iterJSONList(jfile)
+	return json.load(open(jfile))
+
+## METRICS
+
+# 210510: optional per-stage instrumentation, off unless startMetrics() is called.
+# Stages nest: keys are '/'-joined paths (eg bldPRRdb/prr/filter/decode) and sec is
+# exclusive of nested stages.  When off, metricStage/metricIter/metricCount cost one
+# global lookup each, so the hooks stay in production code
+PRRMetrics = None # active MetricsRun
+NoMetricStage = contextlib.nullcontext()
+
+def peakRSSMB():
+	"process peak resident set size so far, in MB (0. where resource is unavailable)"
+	if resource == None:
+		return 0.
+	maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# NB: ru_maxrss is KB on Linux, bytes on macOS
+	return maxrss / (2**20 if sys.platform == 'darwin' else 2**10)
+
+class MetricsRun:
+	'''stage timings, counts and peak memory for one run, written as JSON to outf
+	profFile: also run cProfile over the whole run and dump_stats() there
+	'''
+
+	def __init__(self,outf,profFile=None):
+		self.outf = outf
+		self.profFile = profFile
+		self.stages = defaultdict(lambda: {'n': 0, 'sec': 0., 'totalSec': 0.})
+		self.counts = defaultdict(int)
+		self.stack = [] # [key,startTime,childSec]
+		self.startTime = time.time()
+		self.profiler = None
+		if profFile != None:
+			self.profiler = cProfile.Profile()
+			self.profiler.enable()
+
+	def key(self,name):
+		return self.stack[-1][0] + '/' + name if len(self.stack) > 0 else name
+
+	def push(self,name):
+		self.stack.append([self.key(name),time.perf_counter(),0.])
+
+	def pop(self,sampleMem=False):
+		key,startTime,childSec = self.stack.pop()
+		elapsed = time.perf_counter() - startTime
+		info = self.stages[key]
+		info['n'] += 1
+		info['sec'] += elapsed - childSec
+		info['totalSec'] += elapsed
+		if len(self.stack) > 0:
+			self.stack[-1][2] += elapsed
+		if sampleMem:
+			info['peakRSSMB'] = peakRSSMB()
+
+	@contextlib.contextmanager
+	def stage(self,name):
+		self.push(name)
+		try:
+			yield
+		finally:
+			self.pop(sampleMem=True)
+
+	def timedIter(self,name,rowIter):
+		"time each next() on rowIter as stage name, nested under whatever stage consumes it"
+		rowIter = iter(rowIter)
+		while True:
+			self.push(name)
+			try:
+				row = next(rowIter)
+			except StopIteration:
+				return
+			finally:
+				self.pop()
+			yield row
+
+	def count(self,name,n=1):
+		self.counts[self.key(name)] += n
+
+	def finish(self):
+		if self.profiler != None:
+			self.profiler.disable()
+			self.profiler.dump_stats(self.profFile)
+		metrics = {'argv': sys.argv,
+				'startTime': datetime.datetime.fromtimestamp(self.startTime).isoformat(),
+				'wallSec': time.time() - self.startTime,
+				'peakRSSMB': peakRSSMB(),
+				'stages': dict(self.stages),
+				'counts': dict(self.counts)}
+		with open(self.outf,'w') as outs:
+			json.dump(metrics,outs,indent=1)
+		print(f'MetricsRun: {len(self.stages)} stages -> {self.outf}' + (f', profile -> {self.profFile}' if self.profFile != None else ''))
+
+def startMetrics(outf,profFile=None):
+	"turn on instrumentation; see MetricsRun"
+	global PRRMetrics
+	PRRMetrics = MetricsRun(outf,profFile)
+	return PRRMetrics
+
+def stopMetrics():
+	"write metrics (and profile) of the active run and turn instrumentation off"
+	global PRRMetrics
+	if PRRMetrics != None:
+		PRRMetrics.finish()
+		PRRMetrics = None
+
+def metricStage(name):
+	"context manager timing a stage; no-op when off"
+	return NoMetricStage if PRRMetrics == None else PRRMetrics.stage(name)
+
+def metricIter(name,rowIter):
+	"rowIter, with each next() timed as a stage when on"
+	return rowIter if PRRMetrics == None else PRRMetrics.timedIter(name,rowIter)
+
+def metricCount(name,n=1):
+	if PRRMetrics != None:
+		PRRMetrics.count(name,n)
+
+def metricCounts(stats):
+	"metricCount each numeric entry of a stats dict"
+	if PRRMetrics != None:
+		for name,n in stats.items():
+			if isinstance(n,(int,float)):
+				PRRMetrics.count(name,n)
+
+def metricFn(fn):
+	"decorator: time calls of fn as a stage named for it"
+	@functools.wraps(fn)
+	def wrapper(*args,**kwargs):
+		if PRRMetrics == None:
+			return fn(*args,**kwargs)
+		with PRRMetrics.stage(fn.__name__):
+			return fn(*args,**kwargs)
+	return wrapper
+
+def initPRRdb(currDB,deferIndex=False,dropExisting=True):
+	'''210422: deferIndex: skip request_id indices; caller adds them via addPRRdbIndex after loading
+	210423: dropExisting=False keeps existing tables/rows for incremental sync
+	'''
 
 	curs = currDB.cursor()
 
 	for tblName in PRRdb_fields.keys():
-		curs.execute('DROP TABLE IF EXISTS %s' % (tblName))
+		if dropExisting:
+			curs.execute('DROP TABLE IF EXISTS %s' % (tblName))
 		cmd = "CREATE TABLE IF NOT EXISTS %s (\n" % (tblName)
 
 		# flds = ',\n'.join(['%s %s' % (fld,PRRdb_fields[tblName][fld]) for fld in PRRdb_fields[tblName]])
 		fldList = []
-		for fld in PRRdb_fields[tblName]:
-			fstr = f'{fld} {PRRdb_fields[tblName][fld]}'
+		for fld,ftype in prrTblCols(tblName):
+			fstr = f'{fld} {ftype}'
 			if fld=='id':
 				fstr += ' PRIMARY KEY'
 			fldList.append(fstr)
@@ -205,10 +760,17 @@ def initPRRdb(currDB):
 		cmd += ")\n"
 		curs.execute(cmd)
 
-	# add indices on prr's request_id
-	for tblName in ['event','note','document','depreq']:
-		cmd = f'create index {tblName}_prrIdx on {tblName}(request_id)'
-		curs.execute(cmd)
+	if not dropExisting:
+		addEpochCols(currDB)
+
+	if not deferIndex:
+		addPRRdbIndex(currDB)
+
+	cmd = f'CREATE TABLE IF NOT EXISTS {SyncMetaTbl} (tbl_name TEXT PRIMARY KEY, watermark TEXT, nupsert INTEGER, ndelete INTEGER, sync_date TEXT)'
+	curs.execute(cmd)
+	cmd = f'''CREATE TABLE IF NOT EXISTS {SourceMetaTbl} (tbl_name TEXT PRIMARY KEY, json_file TEXT, size INTEGER,
+			mtime REAL, sha256 TEXT, params TEXT, load_date TEXT)'''
+	curs.execute(cmd)
 		
 	# check to make sure it loaded as expected
 	curs = currDB.cursor()
@@ -219,143 +781,390 @@ def initPRRdb(currDB):
 
 	return currDB
 
-def bldPRRdb(jsonDir,startDate=None,endDate=None):
+def prrTblCols(tblName):
+	"[(column,type)] for tblName: PRRdb_fields then derived epoch columns"
 
-	dbfile = jsonDir +  'prr.db'
-	
-	if os.path.exists(dbfile):
-		os.remove(dbfile)
-		
+	cols = list(PRRdb_fields[tblName].items())
+	for fld in PRRdb_epochFlds.get(tblName,[]):
+		cols += [(fld+'_epoch','INTEGER'), (fld+'_year','INTEGER'), (fld+'_month','INTEGER')]
+	return cols
+
+def nrEpoch(dateStr):
+	"NextRequest timestamp -> (UTC epoch seconds, year, month)"
+	if dateStr == None:
+		return (None,None,None)
+	dt = parseNRDate(dateStr)
+	return (int(dt.timestamp()),dt.year,dt.month)
+
+def addEpochCols(currDB):
+	'''210425: add epoch columns missing from a pre-existing prr.db and fill them
+	from the corresponding TEXT date fields
+	'''
+
+	curs = currDB.cursor()
+	for tblName,epochFlds in PRRdb_epochFlds.items():
+		curs.execute(f'pragma table_info({tblName})')
+		haveCols = set(row[1] for row in curs.fetchall())
+		newFlds = [fld for fld in epochFlds if fld+'_epoch' not in haveCols]
+		if len(newFlds) == 0:
+			continue
+
+		curs.execute('begin')
+		for fld in newFlds:
+			for sfx in ('_epoch','_year','_month'):
+				curs.execute(f'alter table {tblName} add column {fld}{sfx} INTEGER')
+
+			curs.execute(f'select id,{fld} from {tblName} where {fld} is not null')
+			updList = [nrEpoch(dateStr) + (id,) for id,dateStr in curs.fetchall()]
+			cmd = f'update {tblName} set {fld}_epoch=?,{fld}_year=?,{fld}_month=? where id=?'
+			curs.executemany(cmd,updList)
+		curs.execute('commit')
+		print(f'addEpochCols: {tblName} added {newFlds}')
+
+@metricFn
+def addPRRdbIndex(currDB):
+	'''add indices on prr's request_id
+	210425: and on epoch date columns; prr also on request year/month
+	'''
+
+	curs = currDB.cursor()
+	for tblName in ['event','note','document','depreq']:
+		cmd = f'create index if not exists {tblName}_prrIdx on {tblName}(request_id)'
+		curs.execute(cmd)
+
+	for tblName,epochFlds in PRRdb_epochFlds.items():
+		for fld in epochFlds:
+			cmd = f'create index if not exists {tblName}_{fld}Idx on {tblName}({fld}_epoch)'
+			curs.execute(cmd)
+	cmd = 'create index if not exists prr_reqYMIdx on prr(request_date_year,request_date_month)'
+	curs.execute(cmd)
+
+# 210423: per-table watermark (max updated_at) of last incremental sync
+SyncMetaTbl = 'sync_meta'
+
+# 210514: content hash of each PRRdb_json source as of the last build; see bldPRRdb changedOnly
+SourceMetaTbl = 'source_meta'
+
+def sourceMeta(jsonDir,startDate=None,endDate=None,storedMeta=None):
+	'''tblName -> (json_file,size,mtime,sha256,params) for each PRRdb_json source (None if
+	missing).  params: date window, for prr only.  sha256 is reused from storedMeta when
+	size and mtime are unchanged, so unchanged exports are not re-read
+	'''
+
+	if storedMeta == None:
+		storedMeta = {}
+
+	meta = {}
+	for tblName in PRRdb_loadOrder:
+		jfile = jsonDir + PRRdb_json[tblName]
+		if not os.path.exists(jfile):
+			meta[tblName] = None
+			continue
+		fstat = os.stat(jfile)
+		params = repr((startDate,endDate)) if tblName == 'prr' else ''
+		stored = storedMeta.get(tblName)
+		if stored != None and stored[1:3] == (fstat.st_size,fstat.st_mtime):
+			sha = stored[3]
+		else:
+			fileHash = hashlib.sha256()
+			with open(jfile,'rb') as inStr:
+				for chunk in iter(lambda: inStr.read(2**20),b''):
+					fileHash.update(chunk)
+			sha = fileHash.hexdigest()
+		meta[tblName] = (PRRdb_json[tblName],fstat.st_size,fstat.st_mtime,sha,params)
+	return meta
+
+def loadSourceMeta(dbfile):
+	"SourceMetaTbl of dbfile as sourceMeta() dict; {} if none"
+
+	if not os.path.exists(dbfile):
+		return {}
 	currDB = sqlite.connect(dbfile)
-	currDB.isolation_level = None
-	
-	initPRRdb(currDB)
+	try:
+		cmd = f'select tbl_name,json_file,size,mtime,sha256,params from {SourceMetaTbl}'
+		return {row[0]: tuple(row[1:]) for row in currDB.execute(cmd)}
+	except sqlite.OperationalError:
+		return {}
+	finally:
+		currDB.close()
+
+def changedSources(newMeta,storedMeta):
+	"tables whose source size/content/params differ from storedMeta, plus PRRdb_childTbls if prr's do"
+
+	dirtyTbls = set()
+	for tblName,meta in newMeta.items():
+		stored = storedMeta.get(tblName)
+		if meta == None or stored == None or (meta[1],meta[3],meta[4]) != (stored[1],stored[3],stored[4]):
+			dirtyTbls.add(tblName)
+	if 'prr' in dirtyTbls:
+		dirtyTbls.update(PRRdb_childTbls)
+	return dirtyTbls
+
+def saveSourceMeta(cursor,meta):
+	cursor.execute('begin')
+	cmd = f'''insert or replace into {SourceMetaTbl} (tbl_name,json_file,size,mtime,sha256,params,load_date)
+			values (?,?,?,?,?,?,?)'''
+	loadDate = datetime.datetime.now().isoformat()
+	cursor.executemany(cmd,[(tblName,)+info+(loadDate,) for tblName,info in meta.items() if info != None])
+	cursor.execute('commit')
 
-	ninsertPerTrans = 1000
+# 210422: bulk-load settings; safe only because a failed build just discards the temp file
+BulkLoadPragmas = ['journal_mode=OFF',
+				   'synchronous=OFF',
+				   'locking_mode=EXCLUSIVE',
+				   'temp_store=MEMORY',
+				   'cache_size=-200000']
+
+def prrTblSQL(tblName,upsert=False):
+	'''210421: build INSERT statement and column -> json key mapping for tblName, once per table
+	210423: upsert: "insert or replace", keyed on id
+	210425: fldList ends with PRRdb_epochFlds columns, which have no json source
+	returns (sql,fldList,srcFldList)
+	'''
+	fldList = sorted(PRRdb_fields[tblName].keys())
+	# NB: "state" in json dict must be renamed as it is reserved word in SQL
+	srcFldList = ['state' if f == tblName+'_state' else f for f in fldList]
+	fldList += [fld for fld,ftype in prrTblCols(tblName)[len(srcFldList):]]
+
+	flds = ','.join(fldList)
+	qms = ','.join(len(fldList)*'?')
+	verb = 'insert or replace' if upsert else 'insert'
+	sql = '%s into %s (%s) values (%s)' % (verb,tblName,flds,qms)
+
+	return sql,fldList,srcFldList
+
+def prrTblValFn(tblName):
+	"returns function: json dict -> value tuple in prrTblSQL order, incl. epoch columns"
+
+	sql,fldList,srcFldList = prrTblSQL(tblName)
+	getVals = operator.itemgetter(*srcFldList)
+	epochFlds = PRRdb_epochFlds.get(tblName,[])
+	if len(epochFlds) == 0:
+		return getVals
+
+	def rowVals(row):
+		vals = getVals(row)
+		for fld in epochFlds:
+			vals += nrEpoch(row[fld])
+		return vals
+
+	return rowVals
+
+def loadPRRTbl(cursor,tblName,rowIter,batchSize=1000,asVals=False):
+	'''210421: bulk insert json dicts from rowIter into tblName
+	via executemany, one transaction per batchSize rows
+	210424: asVals: rowIter already yields value tuples in prrTblSQL order
+	returns (nrow,lastID)
+	'''
 
-	cursor = currDB.cursor()
-	
-	## load main PRR
-	jfile = jsonDir+'OakPRR_all.json'
-	prrList = json.load(open(jfile))
-	
-	nolder = 0
-	nrecent = 0
-	ncreateB4req = 0
-	nnew = 0
-	reqid2dbidx = {}  # to make filtering of events,notes,docs more efficient
-	
+	sql,fldList,srcFldList = prrTblSQL(tblName)
+	getVals = (lambda vals: vals) if asVals else prrTblValFn(tblName)
+	idPos = fldList.index('id')
+
+	startTime = time.time()
+	nrow = 0
+	lastID = None
+	batch = []
+
+	def flush():
+		cursor.execute('begin')
+		with metricStage('insert'):
+			cursor.executemany(sql,batch)
+		with metricStage('commit'):
+			cursor.execute('commit')
+
+	for row in rowIter:
+		batch.append(getVals(row))
+		if len(batch) == batchSize:
+			flush()
+			nrow += len(batch)
+			lastID = batch[-1][idPos]
+			batch = []
+			# print(f'\t loadPRRTbl: {tblName} row {nrow} lastID={lastID}')
+
+	if len(batch) > 0:
+		flush()
+		nrow += len(batch)
+		lastID = batch[-1][idPos]
+
+	elapsed = time.time() - startTime
+	rate = nrow / elapsed if elapsed > 0 else 0.
+	print(f'loadPRRTbl: {tblName} NRow={nrow} elapsed={elapsed:.2f}s rate={rate:.0f} rows/sec')
+	metricCount('nrow',nrow)
+
+	return nrow,lastID
+
+def isNewer(newDateStr,oldDateStr):
+	"compare NextRequest timestamps; only parse when strings differ"
+	if newDateStr == oldDateStr:
+		return False
+	if newDateStr == None or oldDateStr == None:
+		return True
+	newDate = parseNRDate(newDateStr)
+	oldDate = parseNRDate(oldDateStr)
+	return newDate > oldDate
+
+def syncPRRTbl(cursor,tblName,rowIter,batchSize=1000,asVals=False,changedReqIDs=None):
+	'''210423: incremental counterpart to loadPRRTbl against an existing tblName
+	rows are (re)written only if their id is new or updated_at is newer than the
+	stored row; tables without updated_at compare all column values.
+	Stored rows absent from rowIter are deleted.  Watermark recorded in SyncMetaTbl
+	asVals as for loadPRRTbl
+	210429: changedReqIDs: set collecting PRR ids (old and new) of every written or
+			deleted row, for prr and tables with request_id; see refreshPRRCube
+	returns (nupsert,lastID)
+	'''
+
+	sql,fldList,srcFldList = prrTblSQL(tblName,upsert=True)
+	getVals = (lambda vals: vals) if asVals else prrTblValFn(tblName)
+	idPos = fldList.index('id')
+	updPos = fldList.index('updated_at') if 'updated_at' in fldList else None
+
+	if tblName == 'prr':
+		reqCol = 'id'
+	elif 'request_id' in fldList:
+		reqCol = 'request_id'
+	else:
+		reqCol = None
+	trackReq = changedReqIDs != None and reqCol != None
+
+	startTime = time.time()
+
+	# id -> updated_at, or id -> all values if no updated_at
+	if updPos != None:
+		cursor.execute(f'select id,updated_at from {tblName}')
+		storedTbl = dict(cursor.fetchall())
+	else:
+		cursor.execute(f'select id,{",".join(fldList)} from {tblName}')
+		storedTbl = {row[0]: row[1:] for row in cursor.fetchall()}
+
+	nupsert = 0
+	nsame = 0
+	lastID = None
+	watermark = None
+	batch = []
+
+	def noteReqIDs(idList):
+		"add current (ie, pre-write) PRR ids of rows idList to changedReqIDs"
+		nchunk = 500
+		for i in range(0,len(idList),nchunk):
+			chunk = idList[i:i+nchunk]
+			cmd = f'select {reqCol} from {tblName} where id in ({",".join(len(chunk)*"?")})'
+			cursor.execute(cmd,chunk)
+			changedReqIDs.update(row[0] for row in cursor.fetchall())
+
+	def flush():
+		if trackReq:
+			reqPos = fldList.index(reqCol)
+			changedReqIDs.update(vals[reqPos] for vals in batch)
+			noteReqIDs([vals[idPos] for vals in batch])
+		cursor.execute('begin')
+		with metricStage('insert'):
+			cursor.executemany(sql,batch)
+		with metricStage('commit'):
+			cursor.execute('commit')
+
+	missing = object()
+	for row in rowIter:
+		vals = getVals(row)
+		# NB: pop, so that whatever remains in storedTbl has disappeared from export
+		stored = storedTbl.pop(vals[idPos],missing)
+
+		if updPos != None:
+			updated_at = vals[updPos]
+			if isNewer(updated_at,watermark):
+				watermark = updated_at
+			changed = stored is missing or isNewer(updated_at,stored)
+		else:
+			changed = stored is missing or stored != vals
+
+		if not changed:
+			nsame += 1
+			continue
+
+		batch.append(vals)
+		if len(batch) == batchSize:
+			flush()
+			nupsert += len(batch)
+			lastID = batch[-1][idPos]
+			batch = []
+
+	if len(batch) > 0:
+		flush()
+		nupsert += len(batch)
+		lastID = batch[-1][idPos]
+
+	delList = [(id,) for id in storedTbl.keys()]
+	if trackReq:
+		noteReqIDs(list(storedTbl.keys()))
 	cursor.execute('begin')
-	for prr in prrList:
+	cursor.executemany(f'delete from {tblName} where id=?',delList)
+	cmd = f'insert or replace into {SyncMetaTbl} (tbl_name,watermark,nupsert,ndelete,sync_date) values (?,?,?,?,?)'
+	cursor.execute(cmd,(tblName,watermark,nupsert,len(delList),datetime.datetime.now().isoformat()))
+	cursor.execute('commit')
+
+	elapsed = time.time() - startTime
+	print(f'syncPRRTbl: {tblName} NUpsert={nupsert} NSame={nsame} NDelete={len(delList)} watermark={watermark} elapsed={elapsed:.2f}s')
+	metricCounts({'nupsert': nupsert, 'nsame': nsame, 'ndelete': len(delList)})
+
+	return nupsert,lastID
+
+def filterPRR(prrIter,stats,reqidSet,startDate=None,endDate=None):
+	'''yield PRR within [startDate,endDate), adding their ids to reqidSet
+	stats: nolder, nrecent, ncreateB4req
+	'''
+
+	for prr in prrIter:
 
 		if prr['created_at'] == None:
-			nolder += 1
+			stats['nolder'] += 1
 			continue
 
-		createDate = datetime.datetime.strptime(prr['created_at'],NRDTformat)
-		reqdate = datetime.datetime.strptime(prr['request_date'],NRDTformat)
+		createDate = parseNRDate(prr['created_at'])
+		reqdate = parseNRDate(prr['request_date'])
 		if createDate<reqdate:
-			ncreateB4req += 1
+			stats['ncreateB4req'] += 1
 		minDate = min(createDate,reqdate)
 		maxDate = max(createDate,reqdate)
 		if startDate != None and minDate < startDate:
-			nolder += 1
+			stats['nolder'] += 1
 			continue
 		if endDate != None and maxDate >= endDate:
-			nrecent += 1
+			stats['nrecent'] += 1
 			continue
-		
-		nnew += 1
-		rawFldList = list(PRRdb_fields['prr'].keys())
-		# NB: "state" in json dict must be renamed as it is reserved word in SQL
-		modList = [f if f != 'state' else 'prr_state' for f in rawFldList]
-		fldList = sorted(modList)		
-		
-		flds = ','.join(fldList)
-		qms = ','.join(len(fldList)*'?')
-		sql = 'insert into prr (%s) values (%s)' % (flds,qms)
 
-		valList = [prr[f] if f != 'prr_state' else prr['state'] for f in fldList]
-		
-		cursor.execute(sql,tuple(valList))
-		prrIdx = cursor.lastrowid
-		
-		reqid = prr['id']
-		reqid2dbidx[reqid] = prrIdx
-		
-		if nnew % ninsertPerTrans == 0:
-			cursor.execute('commit')
-			cursor.execute('begin')
-			# print(f'\t bldPRRdb: row {nnew} nolder={nolder} nrecent={nrecent} prrIdx={prrIdx}')
+		reqidSet.add(prr['id'])
+		yield prr
 
-	cursor.execute('commit')
-	cmd = 'select count(*) from prr'
-	cursor.execute(cmd)
-	nprr = cursor.fetchone()[0]
-	print(f'bldPRRdb: PRR done NPRR={nprr} nolder={nolder} nrecent={nrecent} ncreateB4req={ncreateB4req} prrIdx={prrIdx}')
-	
-	## attach EVENTS related newer PRR
-	jfile = jsonDir+'events.json'
-	eventList = json.load(open(jfile))
-	
-	nskip = 0
-	nmissReq = 0
-	nnew = 0
-	cursor.execute('begin')
-	for event in eventList:
-		if 'request_id' not in event:
-			# print('huh')
-			nmissReq += 1
+def filterReqChild(rowIter,stats,reqidSet):
+	'''yield event/note rows attached to PRR in reqidSet
+	stats: nmissReq, nskip
+	'''
+
+	for row in rowIter:
+		if 'request_id' not in row:
+			stats['nmissReq'] += 1
 			continue
-		
-		reqid = event['request_id']
-		if reqid not in reqid2dbidx:
-			nskip += 1
+
+		if row['request_id'] not in reqidSet:
+			stats['nskip'] += 1
 			continue
-		
-		nnew += 1
-		rawFldList = list(PRRdb_fields['event'].keys())
-		# NB: "state" in json dict must be renamed as it is reserved word in SQL
-		modList = [f if f != 'state' else 'event_state' for f in rawFldList]
-		fldList = sorted(modList)		
-		
-		flds = ','.join(fldList)
-		qms = ','.join(len(fldList)*'?')
-		sql = 'insert into event (%s) values (%s)' % (flds,qms)
 
-		valList = [event[f] if f != 'event_state' else event['state'] for f in fldList]
-		
-		cursor.execute(sql,tuple(valList))
-		eventIdx = cursor.lastrowid
-		
-		if nnew % ninsertPerTrans == 0:
-			cursor.execute('commit')
-			cursor.execute('begin')
-			# print(f'\t bldPRRdb: event row {nnew} eventIdx={eventIdx}')
+		yield row
 
-	cursor.execute('commit')
-	cmd = 'select count(*) from event'
-	cursor.execute(cmd)
-	nevent = cursor.fetchone()[0]
-	print(f'bldPRRdb: Event done NEvent={nevent} nskip={nskip} eventIdx={eventIdx}')
-		
-	## attach DOCUMENTS related newer PRR
-	jfile = jsonDir+'documents.json'
-	documentList = json.load(open(jfile))
-	
-	nskip = 0
-	nmissReq = 0
-	nnew = 0
-	missPRR = []
-	cursor.execute('begin')
-	for document in documentList:
+def filterDocument(docIter,stats,reqidSet,missPRR):
+	'''yield documents attached to PRR in reqidSet
+	210415: docs without attending PRR are also kept; their ids appended to missPRR
+	stats: nmissReq, nskip
+	'''
+
+	for document in docIter:
 		if 'request_id' not in document:
-			# print('huh')
-			nmissReq += 1
+			stats['nmissReq'] += 1
 			continue
-		
+
 		reqid = document['request_id']
-		
+
 		# 210415: check for docs without attending PRR; maintain these in DB
 		noPRR = False
 		try:
@@ -363,283 +1172,1268 @@ def bldPRRdb(jsonDir,startDate=None,endDate=None):
 		except:
 			missPRR.append(document['id'])
 			noPRR = True
-		
-		if reqid not in reqid2dbidx and not noPRR:
-			nskip += 1
+
+		if reqid not in reqidSet and not noPRR:
+			stats['nskip'] += 1
 			continue
-		
-		nnew += 1
-		rawFldList = list(PRRdb_fields['document'].keys())
-		# NB: "state" in json dict must be renamed as it is reserved word in SQL
-		modList = [f if f != 'state' else 'document_state' for f in rawFldList]
-		fldList = sorted(modList)		
-		
-		flds = ','.join(fldList)
-		qms = ','.join(len(fldList)*'?')
-		sql = 'insert into document (%s) values (%s)' % (flds,qms)
 
 		# 210415: 2do: focus only on state=PUBLIC documents?
 
-		valList = [document[f] if f != 'document_state' else document['state'] for f in fldList]
-		
-		cursor.execute(sql,tuple(valList))
-		documentIdx = cursor.lastrowid
+		yield document
+
+def filterDepreq(depreqIter,stats,reqidSet):
+	'''yield depreq attached to PRR in reqidSet
+	210415: Only consider depreq with deleted=false
+	stats: nmissReq, nskip
+	'''
+
+	for depreq in depreqIter:
+		if 'request_id' not in depreq:
+			stats['nmissReq'] += 1
+			continue
+
+		if depreq['deleted'] == True:
+			stats['nskip'] += 1
+			continue
+
+		if depreq['request_id'] not in reqidSet:
+			stats['nskip'] += 1
+			continue
+
+		yield depreq
+
+def filterTbl(tblName,rowIter,stats,reqidSet,missPRR=None,startDate=None,endDate=None):
+	"apply bldPRRdb's filter for tblName to rowIter of json dicts"
+
+	if tblName == 'prr':
+		return filterPRR(rowIter,stats,reqidSet,startDate,endDate)
+	if tblName in ('event','note'):
+		return filterReqChild(rowIter,stats,reqidSet)
+	if tblName == 'document':
+		return filterDocument(rowIter,stats,reqidSet,missPRR)
+	if tblName == 'depreq':
+		return filterDepreq(rowIter,stats,reqidSet)
+	return rowIter
+
+def decodeTblWorker(tblName,jfile,reqidSet,startDate,endDate,batchSize,outQ):
+	'''210424: PRRDecodePool worker: decode and filter one JSON export,
+	putting ('rows',valBatch) messages and a final ('done',stats,missPRR) on outQ
+	'''
+
+	try:
+		stats = defaultdict(int)
+		missPRR = []
+		if reqidSet == None:
+			reqidSet = set()
+		getVals = prrTblValFn(tblName)
+
+		batch = []
+		for row in filterTbl(tblName,iterJSONList(jfile),stats,reqidSet,missPRR,startDate,endDate):
+			batch.append(getVals(row))
+			if len(batch) == batchSize:
+				outQ.put(('rows',batch))
+				batch = []
+		if len(batch) > 0:
+			outQ.put(('rows',batch))
+
+		outQ.put(('done',dict(stats),missPRR))
+	except Exception:
+		outQ.put(('error',traceback.format_exc()))
+
+DecodePollSec = 5. # PRRDecodePool: check worker liveness this often while waiting
+
+class PRRDecodePool:
+	'''210424: decode+filter JSON exports in up to nworkers processes, streaming
+	value batches back to the single SQLite writer (the caller).
+	Decoders start in PRRdb_loadOrder; PRRdb_childTbls wait for the prr pass
+	to fill reqidSet.  Tables must be consumed via tblVals() in PRRdb_loadOrder
+	210514: tblList: only decode these tables
+	'''
+
+	def __init__(self,jsonDir,startDate=None,endDate=None,nworkers=4,batchSize=1000,qsize=4,tblList=None,reqidSet=None):
+		self.jsonDir = jsonDir
+		self.startDate = startDate
+		self.endDate = endDate
+		self.nworkers = nworkers
+		self.batchSize = batchSize
+		self.qsize = qsize
+
+		# NB: tblList without prr: reqidSet must already hold the PRR ids
+		self.pending = [tblName for tblName in PRRdb_loadOrder if tblList == None or tblName in tblList]
+		self.reqidSet = reqidSet if reqidSet != None else set()
+		self.prrDone = 'prr' not in self.pending
+		self.running = {} # tblName -> (proc,outQ)
+
+		self.startMore()
+
+	def startMore(self):
+		for tblName in list(self.pending):
+			if len(self.running) >= self.nworkers:
+				break
+			if tblName in PRRdb_childTbls and not self.prrDone:
+				continue
+
+			self.pending.remove(tblName)
+			reqidSet = self.reqidSet if tblName in PRRdb_childTbls else None
+			outQ = multiprocessing.Queue(self.qsize)
+			jfile = self.jsonDir + PRRdb_json[tblName]
+			proc = multiprocessing.Process(target=decodeTblWorker,
+							args=(tblName,jfile,reqidSet,self.startDate,self.endDate,self.batchSize,outQ),
+							daemon=True)
+			proc.start()
+			self.running[tblName] = (proc,outQ)
+
+	def tblVals(self,tblName,stats,missPRR=None):
+		"yield value tuples for tblName; worker's stats/missPRR merged once exhausted"
+
+		proc,outQ = self.running[tblName]
+		idPos = prrTblSQL(tblName)[1].index('id')
+
+		while True:
+			try:
+				msg = outQ.get(timeout=DecodePollSec)
+			except queue.Empty:
+				if proc.exitcode == None:
+					continue
+				# NB: worker may have exited just after our timeout; drain once more
+				try:
+					msg = outQ.get(timeout=DecodePollSec)
+				except queue.Empty:
+					raise RuntimeError(f'PRRDecodePool: {tblName} decoder died, exitcode={proc.exitcode}') from None
+			if msg[0] == 'rows':
+				if tblName == 'prr':
+					self.reqidSet.update(vals[idPos] for vals in msg[1])
+				yield from msg[1]
+			elif msg[0] == 'done':
+				stats.update(msg[1])
+				if missPRR != None:
+					missPRR.extend(msg[2])
+				break
+			else:
+				raise RuntimeError(f'PRRDecodePool: {tblName} decoder failed\n{msg[1]}')
+
+		proc.join()
+		del self.running[tblName]
+		if tblName == 'prr':
+			self.prrDone = True
+		self.startMore()
+
+@metricFn
+def bldPRRdb(jsonDir,startDate=None,endDate=None,streamJSON=True,batchSize=1000,bulkBuild=True,incremental=False,nworkers=0,ftsIndex=False,prrCube=True,prrSLA=True,changedOnly=False):
+	'''210420: streamJSON: parse JSON exports element by element (flat memory)
+	210421: batchSize: rows per executemany/transaction
+	210422: bulkBuild: load into a temp file with BulkLoadPragmas, build indices
+			and ANALYZE after all tables are loaded, then atomically rename over prr.db
+			so readers of the old DB are never interrupted
+	210423: incremental: update existing prr.db in place via syncPRRTbl
+			(only new/updated rows written, vanished rows deleted); bulkBuild ignored
+	210424: nworkers>0: decode/filter JSON in a PRRDecodePool; this process remains
+			the only SQLite writer and DB content is identical to the serial path
+	210428: ftsIndex: (re)build FTS5 indices over PRRdb_ftsFlds; see searchPRRText.
+			incremental: existing FTS5 indices are always rebuilt
+	210429: prrCube: build PRRCubeTbl; incremental refreshes only changed PRR's cells
+	210511: prrSLA: (re)build PRRSLATbl business-day measures
+	210514: source size/sha256 (and prr's date window) recorded in SourceMetaTbl,
+			only after all derived tables are rebuilt.
+			changedOnly: if prr.db exists, incremental update of only the tables whose
+			source changed since, plus PRRdb_childTbls if prr's did; nothing to do if none
+	'''
+
+	dbfile = jsonDir +  'prr.db'
+
+	# NB: any existing prr.db's meta, so every build skips hashing unchanged exports
+	storedMeta = loadSourceMeta(dbfile)
+	srcMeta = sourceMeta(jsonDir,startDate,endDate,storedMeta)
+	skipTbls = set()
+	if changedOnly and os.path.exists(dbfile):
+		incremental = True
+		dirtyTbls = changedSources(srcMeta,storedMeta)
+		if len(dirtyTbls) == 0:
+			# NB: record new mtimes, so unchanged content isn't hashed again next time
+			currDB = sqlite.connect(dbfile)
+			currDB.isolation_level = None
+			saveSourceMeta(currDB.cursor(),srcMeta)
+			currDB.close()
+			print(f'bldPRRdb: no source changed since last build of {dbfile}')
+			return
+		skipTbls = set(PRRdb_loadOrder) - dirtyTbls
+		print(f'bldPRRdb: changed {sorted(dirtyTbls)}; skipping {sorted(skipTbls)}')
+	
+	if incremental:
+		bulkBuild = False
+		bldfile = dbfile
+	elif bulkBuild:
+		bldfile = dbfile + '.bld'
+		if os.path.exists(bldfile):
+			os.remove(bldfile)
+	else:
+		bldfile = dbfile
+		if os.path.exists(dbfile):
+			os.remove(dbfile)
+		
+	currDB = sqlite.connect(bldfile)
+	currDB.isolation_level = None
+	
+	if bulkBuild:
+		for pragma in BulkLoadPragmas:
+			currDB.execute('pragma '+pragma)
+
+	initPRRdb(currDB,deferIndex=bulkBuild,dropExisting=not incremental)
+
+	changedReqIDs = set()
+	if incremental:
+		loadTbl = lambda *args: syncPRRTbl(*args,changedReqIDs=changedReqIDs)
+	else:
+		loadTbl = loadPRRTbl
+
+	cursor = currDB.cursor()
+	
+	reqidSet = set()  # to make filtering of events,notes,docs more efficient
+	if 'prr' in skipTbls:
+		cursor.execute('select id from prr')
+		reqidSet.update(row[0] for row in cursor.fetchall())
+
+	if nworkers > 0:
+		loadTbls = [tblName for tblName in PRRdb_loadOrder if tblName not in skipTbls]
+		decodePool = PRRDecodePool(jsonDir,startDate,endDate,nworkers,batchSize,tblList=loadTbls,reqidSet=reqidSet)
+	else:
+		decodePool = None
+
+	def tblRows(tblName,stats,missPRR=None):
+		"returns (rowIter,asVals) of filtered rows for tblName"
+		if decodePool != None:
+			return metricIter('decode',decodePool.tblVals(tblName,stats,missPRR)),True
+		jfile = jsonDir+PRRdb_json[tblName]
+		rowIter = metricIter('decode',loadJSONList(jfile,streamJSON))
+		rowIter = metricIter('filter',filterTbl(tblName,rowIter,stats,reqidSet,missPRR,startDate,endDate))
+		return rowIter,False
+
+	def loadTblRows(tblName,stats,missPRR=None):
+		"load tblRows() into tblName, as metric stage tblName; returns (nnew,lastID)"
+		if tblName in skipTbls:
+			return 0,None
+		rowIter,asVals = tblRows(tblName,stats,missPRR)
+		with metricStage(tblName):
+			nnew,lastID = loadTbl(cursor,tblName,rowIter,batchSize,asVals)
+			metricCounts(stats)
+		return nnew,lastID
+
+	## load main PRR
+	stats = defaultdict(int)
+	nnew,prrIdx = loadTblRows('prr',stats)
+
+	cmd = 'select count(*) from prr'
+	cursor.execute(cmd)
+	nprr = cursor.fetchone()[0]
+	print(f'bldPRRdb: PRR done NPRR={nprr} nolder={stats["nolder"]} nrecent={stats["nrecent"]} ncreateB4req={stats["ncreateB4req"]} prrIdx={prrIdx}')
+	
+	## attach EVENTS related newer PRR
+	stats = defaultdict(int)
+	nnew,eventIdx = loadTblRows('event',stats)
+
+	cmd = 'select count(*) from event'
+	cursor.execute(cmd)
+	nevent = cursor.fetchone()[0]
+	print(f'bldPRRdb: Event done NEvent={nevent} nskip={stats["nskip"]} eventIdx={eventIdx}')
 		
-		if nnew % ninsertPerTrans == 0:
-			cursor.execute('commit')
-			cursor.execute('begin')
-			# print(f'\t bldPRRdb: document row {nnew} nskip={nskip} documentIdx={documentIdx}')
+	## attach DOCUMENTS related newer PRR
+	stats = defaultdict(int)
+	missPRR = []
+	nnew,documentIdx = loadTblRows('document',stats,missPRR)
 
-	cursor.execute('commit')
 	cmd = 'select count(*) from document'
 	cursor.execute(cmd)
 	ndoc = cursor.fetchone()[0]
-	print(f'bldPRRdb: Document done NDoc={ndoc} nskip={nskip} documentIdx={documentIdx} NDoc w/o PRR={len(missPRR)}')
+	print(f'bldPRRdb: Document done NDoc={ndoc} nskip={stats["nskip"]} documentIdx={documentIdx} NDoc w/o PRR={len(missPRR)}')
 
-	outf = jsonDir + 'docID-missPRR.csv'
-	outs = open(outf,'w')
-	outs.write('docID\n')
-	for docID in missPRR:
-		outs.write(f'{docID}\n')
-	outs.close()
+	if 'document' not in skipTbls:
+		outf = jsonDir + 'docID-missPRR.csv'
+		outs = open(outf,'w')
+		outs.write('docID\n')
+		for docID in missPRR:
+			outs.write(f'{docID}\n')
+		outs.close()
 		
 	## attach NOTES related newer PRR
-	jfile = jsonDir+'notes.json'
-	noteList = json.load(open(jfile))
-	
-	nskip = 0
-	nmissReq = 0
-	nnew = 0
-	cursor.execute('begin')
-	for note in noteList:
-		if 'request_id' not in note:
-			# print('huh')
-			nmissReq += 1
-			continue
-		
-		reqid = note['request_id']
-		if reqid not in reqid2dbidx:
-			nskip += 1
-			continue
-		
-		nnew += 1
-		rawFldList = list(PRRdb_fields['note'].keys())
-		# NB: "state" in json dict must be renamed as it is reserved word in SQL
-		modList = [f if f != 'state' else 'note_state' for f in rawFldList]
-		fldList = sorted(modList)		
-		
-		flds = ','.join(fldList)
-		qms = ','.join(len(fldList)*'?')
-		sql = 'insert into note (%s) values (%s)' % (flds,qms)
+	stats = defaultdict(int)
+	nnew,noteIdx = loadTblRows('note',stats)
 
-		valList = [note[f] if f != 'note_state' else note['state'] for f in fldList]
-		
-		cursor.execute(sql,tuple(valList))
-		noteIdx = cursor.lastrowid
-		
-		if nnew % ninsertPerTrans == 0:
-			cursor.execute('commit')
-			cursor.execute('begin')
-			# print(f'\t bldPRRdb: note row {nnew} nskip={nskip} noteIdx={noteIdx}')
-	
-	cursor.execute('commit')	
 	cmd = 'select count(*) from note'
 	cursor.execute(cmd)
 	nnote = cursor.fetchone()[0]
-	print(f'bldPRRdb: Note done NNote={nnote} nskip={nskip} noteIdx={noteIdx}')
+	print(f'bldPRRdb: Note done NNote={nnote} nskip={stats["nskip"]} noteIdx={noteIdx}')
 
 	## get all DEPARTMENTS
-	jfile = jsonDir+'departments.json'
-	departmentList = json.load(open(jfile))
-	
-	nskip = 0
-	nmissReq = 0
-	cursor.execute('begin')
-	for ni,department in enumerate(departmentList):
-				
-		rawFldList = list(PRRdb_fields['department'].keys())
-		fldList = sorted(rawFldList)		
-		
-		flds = ','.join(fldList)
-		qms = ','.join(len(fldList)*'?')
-		sql = 'insert into department (%s) values (%s)' % (flds,qms)
+	nnew,departmentIdx = loadTblRows('department',defaultdict(int))
 
-		valList = [department[f]  for f in fldList]
-		
-		cursor.execute(sql,tuple(valList))
-		departmentIdx = cursor.lastrowid
-	cursor.execute('commit')					
 	cmd = 'select count(*) from department'
 	cursor.execute(cmd)
 	ndept = cursor.fetchone()[0]
 	print(f'bldPRRdb: Department done NDept={ndept} departmentIdx={departmentIdx}')
 
 	## attach departments_requests related newer PRR
-	jfile = jsonDir+'departments_requests.json'
-	depreqList = json.load(open(jfile))
-	
-	nskip = 0
-	nmissReq = 0
-	nnew = 0
-	cursor.execute('begin')
-	for depreq in depreqList:
-		
-		if 'request_id' not in depreq:
-			# print('huh')
-			nmissReq += 1
-			continue
-
-		# 210415: Only consider depreq with deleted=false
-		if depreq['deleted'] == True:
-			nskip += 1
-			continue
-		
-		reqid = depreq['request_id']
-		if reqid not in reqid2dbidx:
-			nskip += 1
-			continue
-		
-		nnew += 1
-		rawFldList = list(PRRdb_fields['depreq'].keys())
-		fldList = sorted(rawFldList)		
-		
-		flds = ','.join(fldList)
-		qms = ','.join(len(fldList)*'?')
-		sql = 'insert into depreq (%s) values (%s)' % (flds,qms)
+	stats = defaultdict(int)
+	nnew,depreqIdx = loadTblRows('depreq',stats)
 
-		valList = [depreq[f] for f in fldList]
-		
-		cursor.execute(sql,tuple(valList))
-		depreqIdx = cursor.lastrowid
-		
-		if ni % ninsertPerTrans == 0:
-			cursor.execute('commit')
-			cursor.execute('begin')
-			# print(f'\t bldPRRdb: depreq row {ni} nskip={nskip} depreqIdx={depreqIdx}')
-	
-	cursor.execute('commit')		
 	cmd = 'select count(*) from depreq'
 	cursor.execute(cmd)
 	ndepreq = cursor.fetchone()[0]
-	print(f'bldPRRdb: depreq done NDepReq={ndepreq} nskip={nskip} depreqIdx={depreqIdx}')
+	print(f'bldPRRdb: depreq done NDepReq={ndepreq} nskip={stats["nskip"]} depreqIdx={depreqIdx}')
 
 	# 210331: add  event_type, message_template, notes_message_templates
 
 	## attach EVENT_TYPE
-	jfile = jsonDir+'event_types.json'
-	etypeList = json.load(open(jfile))
-	
-	nmissReq = 0
-	nnew = 0
-	cursor.execute('begin')
-	for etype in etypeList:
-		
-		nnew += 1
-		rawFldList = list(PRRdb_fields['event_type'].keys())
-		fldList = sorted(rawFldList)		
-		
-		flds = ','.join(fldList)
-		qms = ','.join(len(fldList)*'?')
-		sql = 'insert into event_type (%s) values (%s)' % (flds,qms)
+	nnew,etypeIdx = loadTblRows('event_type',defaultdict(int))
 
-		valList = [etype[f] for f in fldList]
-		
-		cursor.execute(sql,tuple(valList))
-		etypeIdx = cursor.lastrowid
-		
-		if nnew % ninsertPerTrans == 0:
-			cursor.execute('commit')
-			cursor.execute('begin')
-			# print(f'\t bldPRRdb: etype row {nnew} etypeIdx={etypeIdx}')
-	
-	cursor.execute('commit')	
 	cmd = 'select count(*) from event_type'
 	cursor.execute(cmd)
 	netype = cursor.fetchone()[0]
 	print(f'bldPRRdb: Event_type done NEventType={netype} etypeIdx={etypeIdx}')
 	
 	## attach MESSAGE_TEMPLATE
-	jfile = jsonDir+'message_templates.json'
-	msgtmpList = json.load(open(jfile))
-	
-	nmissReq = 0
-	nnew = 0
-	cursor.execute('begin')
-	for msgtmp in msgtmpList:
-		
-		nnew += 1
-		rawFldList = list(PRRdb_fields['message_templates'].keys())
-		fldList = sorted(rawFldList)		
-		
-		flds = ','.join(fldList)
-		qms = ','.join(len(fldList)*'?')
-		sql = 'insert into message_templates (%s) values (%s)' % (flds,qms)
+	nnew,msgtmpIdx = loadTblRows('message_templates',defaultdict(int))
 
-		valList = [msgtmp[f] for f in fldList]
-		
-		cursor.execute(sql,tuple(valList))
-		msgtmpIdx = cursor.lastrowid
-		
-		if nnew % ninsertPerTrans == 0:
-			cursor.execute('commit')
-			cursor.execute('begin')
-			# print(f'\t bldPRRdb: msgtmp row {nnew} msgtmpIdx={msgtmpIdx}')
-	
-	cursor.execute('commit')	
 	cmd = 'select count(*) from message_templates'
 	cursor.execute(cmd)
 	nmtmp = cursor.fetchone()[0]
 	print(f'bldPRRdb: msgtmp NMsgTemplate={nmtmp} done  msgtmpIdx={msgtmpIdx}')
 
 	## attach NOTE_TEMPLATE
-	jfile = jsonDir+'notes_message_templates.json'
-	notetempList = json.load(open(jfile))
-	
-	nmissReq = 0
-	nnew = 0
-	cursor.execute('begin')
-	for notetemp in notetempList:
-		
-		nnew += 1
-		rawFldList = list(PRRdb_fields['notes_message_templates'].keys())
-		fldList = sorted(rawFldList)		
-		
-		flds = ','.join(fldList)
-		qms = ','.join(len(fldList)*'?')
-		sql = 'insert into notes_message_templates (%s) values (%s)' % (flds,qms)
+	nnew,notetempIdx = loadTblRows('notes_message_templates',defaultdict(int))
 
-		valList = [notetemp[f] for f in fldList]
-		
-		cursor.execute(sql,tuple(valList))
-		notetempIdx = cursor.lastrowid
-		
-		if nnew % ninsertPerTrans == 0:
-			cursor.execute('commit')
-			cursor.execute('begin')
-			# print(f'\t bldPRRdb: notetemp row {nnew} notetempIdx={notetempIdx}')
-	
-	cursor.execute('commit')	
 	cmd = 'select count(*) from notes_message_templates'
 	cursor.execute(cmd)
 	nnmsg = cursor.fetchone()[0]
 	print(f'bldPRRdb: notetemp done NNoteMsg={nnmsg} notetempIdx={notetempIdx}')
 
-def bldIndexTblCSV(inf,startDate=None,endDate=None):
+	if bulkBuild:
+		startTime = time.time()
+		addPRRdbIndex(currDB)
+
+	try:
+		if prrCube:
+			refreshPRRCube(currDB,changedReqIDs if incremental else None)
+
+		if prrSLA:
+			bldPRRSLA(currDB)
+
+		# NB: external-content FTS tables don't track their content tables; an existing
+		# index is stale after any incremental sync (incl changedOnly, watchPRRdb)
+		if incremental and not ftsIndex:
+			ftsTbls = [tblName+'_fts' for tblName in PRRdb_ftsFlds]
+			cursor.execute(f"select count(*) from sqlite_master where type='table' and name in ({','.join('?'*len(ftsTbls))})",ftsTbls)
+			ftsIndex = cursor.fetchone()[0] > 0
+
+		if ftsIndex:
+			bldPRRFTS(currDB)
+	except Exception:
+		# NB: base tables are already synced, so a retry sees no changed PRR;
+		# drop the cube so its next refresh is a full rebuild
+		if incremental:
+			if currDB.in_transaction:
+				cursor.execute('rollback')
+			cursor.execute(f'drop table if exists {PRRCubeTbl}')
+		raise
+
+	# NB: only once derived tables are rebuilt; if any of them fail, changedOnly
+	# must not see the new sources as already loaded
+	saveSourceMeta(cursor,srcMeta)
+
+	if bulkBuild:
+		with metricStage('analyze'):
+			cursor.execute('analyze')
+		currDB.close()
+		os.replace(bldfile,dbfile)
+		print(f'bldPRRdb: index+analyze done; {bldfile} -> {dbfile} elapsed={time.time()-startTime:.2f}s')
+
+def watchPRRdb(jsonDir,startDate=None,endDate=None,interval=60,**bldArgs):
+	'''210514: poll jsonDir's PRRdb_json sources every interval seconds; once their
+	size/mtime have changed and then held steady for a poll (so half-written exports
+	are not loaded) run bldPRRdb(changedOnly=True).  First build after the first poll.
+	A failed build is reported and retried on the next change; ^C stops
+	'''
+
+	def fileStamp():
+		stamp = {}
+		for tblName in PRRdb_loadOrder:
+			jfile = jsonDir + PRRdb_json[tblName]
+			if os.path.exists(jfile):
+				fstat = os.stat(jfile)
+				stamp[tblName] = (fstat.st_size,fstat.st_mtime)
+		return stamp
+
+	print(f'watchPRRdb: watching {jsonDir} every {interval}s')
+	lastStamp = fileStamp()
+	bldStamp = None
+	try:
+		while True:
+			time.sleep(interval)
+			stamp = fileStamp()
+			if stamp != bldStamp and stamp == lastStamp:
+				try:
+					bldPRRdb(jsonDir,startDate,endDate,changedOnly=True,**bldArgs)
+				except Exception:
+					print(f'watchPRRdb: build failed?!\n{traceback.format_exc()}')
+				bldStamp = stamp
+			lastStamp = stamp
+	except KeyboardInterrupt:
+		print('watchPRRdb: stopped')
+
+@metricFn
+def bldPRRFTS(currDB):
+	'''210428: build external-content FTS5 tables <tbl>_fts over PRRdb_ftsFlds
+	NB: rebuilt from scratch, also after incremental sync
+	'''
+
+	startTime = time.time()
+	curs = currDB.cursor()
+	curs.execute('begin')
+	for tblName,ftsFlds in PRRdb_ftsFlds.items():
+		ftsTbl = tblName+'_fts'
+		curs.execute(f'drop table if exists {ftsTbl}')
+		cmd = f"create virtual table {ftsTbl} using fts5({','.join(ftsFlds)}, content='{tblName}', content_rowid='id')"
+		curs.execute(cmd)
+		curs.execute(f"insert into {ftsTbl}({ftsTbl}) values('rebuild')")
+	curs.execute('commit')
+	print(f'bldPRRFTS: done elapsed={time.time()-startTime:.2f}s')
+
+def searchPRRText(currDB,query,limit=100,tblList=None):
+	'''210428: full-text search over prr/note/document text (built by bldPRRFTS)
+	query: FTS5 syntax, eg 'redact*' or '"police report"'
+	returns [(prr_id,score)], best first; score is a PRR's best FTS5 rank (bm25, lower=better)
+	over the tables in tblList (default all of PRRdb_ftsFlds)
+	'''
+
+	if tblList == None:
+		tblList = list(PRRdb_ftsFlds.keys())
+
+	subList = []
+	for tblName in tblList:
+		ftsTbl = tblName+'_fts'
+		if tblName == 'prr':
+			subList.append(f'select rowid as prr_id,{ftsTbl}.rank as score from {ftsTbl} where {ftsTbl} match ?')
+		else:
+			subList.append(f'select {tblName}.request_id as prr_id,{ftsTbl}.rank as score from {ftsTbl} join {tblName} on {tblName}.id={ftsTbl}.rowid where {ftsTbl} match ?')
+
+	cmd = f'''select prr_id,min(score) as score from ({' union all '.join(subList)})
+			where prr_id is not null group by prr_id order by score limit ?'''
+	curs = currDB.cursor()
+	curs.execute(cmd,tuple(len(subList)*[query])+(limit,))
+	return curs.fetchall()
+
+# 210429: department x year x month x prr_state x closure_reasons aggregate of prr;
+# sums/sums of squares let reports derive means and stdevs, and merge cells
+PRRCubeTbl = 'prr_cube'
+PRRCubeMemberTbl = 'prr_cube_prr' # prr_id -> (year,month) cell it was last counted in
+
+PRRCube_fields = {
+	'department_id': 'INTEGER',
+	'year': 'INTEGER',
+	'month': 'INTEGER',
+	'prr_state': 'TEXT',
+	'closure_reasons': 'TEXT',
+	'nprr': 'INTEGER',
+	'nclose': 'INTEGER',		# prr_state 'Closed', as anlyzRedact's NClose
+	'nclose_days': 'INTEGER',	# PRR with closed_date, ie n of close_days_sum
+	'close_days_sum': 'INTEGER',
+	'close_days_sumsq': 'INTEGER',
+	'ndoc_sum': 'INTEGER',
+	'ndoc_sumsq': 'INTEGER',
+	# 210501: TDigest BLOBs, see sketchPRRCube; close days split as anlyzRedact does
+	'close_days_digest': 'BLOB',
+	'rclose_days_digest': 'BLOB',
+	'ndoc_digest': 'BLOB',
+	'frac_redact_digest': 'BLOB'
+}
+
+PRRCubeSketches = ['close_days','rclose_days','ndoc','frac_redact']
+
+# NB: floor, to match timedelta.days for (closeDate - reqDate)
+CloseDaysSQL = '''((prr.closed_date_epoch - prr.request_date_epoch)
+	- (((prr.closed_date_epoch - prr.request_date_epoch) % 86400) + 86400) % 86400) / 86400'''
+
+@metricFn
+def refreshPRRCube(currDB,changedReqIDs=None):
+	'''210429: (re)build PRRCubeTbl; one row per PRR per department (NULL if none)
+	changedReqIDs: only recompute the (year,month) cells these PRRs were or are in;
+		None rebuilds everything
+	'''
+
+	startTime = time.time()
+	curs = currDB.cursor()
+	curs.execute('begin')
+
+	curs.execute(f'pragma table_info({PRRCubeTbl})')
+	haveCube = set(PRRCube_fields.keys()) <= set(row[1] for row in curs.fetchall())
+	if changedReqIDs == None or not haveCube:
+		curs.execute(f'drop table if exists {PRRCubeTbl}')
+		curs.execute(f'drop table if exists {PRRCubeMemberTbl}')
+		flds = ',\n'.join([f'{fld} {ftype}' for fld,ftype in PRRCube_fields.items()])
+		curs.execute(f'create table {PRRCubeTbl} (\n{flds})')
+		curs.execute(f'create index {PRRCubeTbl}_cellIdx on {PRRCubeTbl}(year,month,department_id)')
+		curs.execute(f'create table {PRRCubeMemberTbl} (prr_id INTEGER PRIMARY KEY, year INTEGER, month INTEGER)')
+		prrWhere = ''
+		memberWhere = ''
+	else:
+		curs.execute('create temp table if not exists cube_dirty (prr_id INTEGER PRIMARY KEY)')
+		curs.execute('delete from temp.cube_dirty')
+		curs.executemany('insert into temp.cube_dirty values (?)',[(id,) for id in changedReqIDs])
+
+		curs.execute('create temp table if not exists cube_month (year INTEGER, month INTEGER)')
+		curs.execute('delete from temp.cube_month')
+		cmd = f'''insert into temp.cube_month
+				select year,month from {PRRCubeMemberTbl} where prr_id in (select prr_id from temp.cube_dirty)
+				union
+				select request_date_year,request_date_month from prr where id in (select prr_id from temp.cube_dirty)'''
+		curs.execute(cmd)
+
+		curs.execute(f'delete from {PRRCubeTbl} where (year,month) in (select year,month from temp.cube_month)')
+		curs.execute(f'delete from {PRRCubeMemberTbl} where prr_id in (select prr_id from temp.cube_dirty)')
+		prrWhere = 'where (prr.request_date_year,prr.request_date_month) in (select year,month from temp.cube_month)'
+		memberWhere = 'where id in (select prr_id from temp.cube_dirty)'
+
+	aggFlds = [fld for fld in PRRCube_fields.keys() if not fld.endswith('_digest')]
+	cmd = f'''insert into {PRRCubeTbl} ({','.join(aggFlds)})
+			select depreq.department_id,p.year,p.month,p.prr_state,p.closure_reasons,
+				count(*),sum(p.prr_state='Closed'),count(p.closeDays),sum(p.closeDays),sum(p.closeDays*p.closeDays),
+				sum(p.ndoc),sum(p.ndoc*p.ndoc)
+			from (select prr.id,prr.request_date_year as year,prr.request_date_month as month,
+					prr.prr_state,prr.closure_reasons,{CloseDaysSQL} as closeDays,
+					(select count(*) from document where document.request_id=prr.id) as ndoc
+				from prr {prrWhere}) p
+			left join depreq on depreq.request_id=p.id
+			group by 1,2,3,4,5'''
+	curs.execute(cmd)
+	cmd = f'''insert into {PRRCubeMemberTbl} (prr_id,year,month)
+			select id,request_date_year,request_date_month from prr {memberWhere}'''
+	curs.execute(cmd)
+
+	sketchPRRCube(curs,prrWhere)
+	curs.execute('commit')
+
+	ncell = curs.execute(f'select count(*) from {PRRCubeTbl}').fetchone()[0]
+	nchange = 'all' if changedReqIDs == None else len(changedReqIDs)
+	print(f'refreshPRRCube: NCell={ncell} NChangedPRR={nchange} elapsed={time.time()-startTime:.2f}s')
+
+def sketchPRRCube(curs,prrWhere=''):
+	'''210501: fill PRRCubeSketches TDigest columns of the cube cells selected by prrWhere
+	streams per-PRR values; memory is one digest per cell and sketch
+	'''
+
+	cmd = f'''select depreq.department_id,p.year,p.month,p.prr_state,p.closure_reasons,
+				p.closeDays,p.ndoc,p.nredact
+			from (select prr.id,prr.request_date_year as year,prr.request_date_month as month,
+					prr.prr_state,prr.closure_reasons,{CloseDaysSQL} as closeDays,
+					(select count(*) from document where document.request_id=prr.id) as ndoc,
+					(select sum(instr(lower(title),'redact')=0) from document where document.request_id=prr.id) as nredact
+				from prr {prrWhere}) p
+			left join depreq on depreq.request_id=p.id'''
+	curs.execute(cmd)
+
+	cellTbl = defaultdict(lambda: {sketch: TDigest() for sketch in PRRCubeSketches})
+	# NB: iterate the cursor itself; the executemany below only reuses it once drained
+	for row in curs:
+		(closeDays,ndoc,nredact) = row[5:]
+		nredact = nredact if nredact != None else 0
+		digests = cellTbl[row[:5]]
+		if closeDays != None:
+			digests['rclose_days' if nredact>0 else 'close_days'].add(closeDays)
+		digests['ndoc'].add(ndoc)
+		digests['frac_redact'].add(float(nredact) / ndoc if ndoc>0 else 0.)
+
+	updList = []
+	for cell,digests in cellTbl.items():
+		blobs = [digests[sketch].toBytes() if digests[sketch].count() > 0 else None for sketch in PRRCubeSketches]
+		updList.append(tuple(blobs) + cell)
+	sets = ','.join([f'{sketch}_digest=?' for sketch in PRRCubeSketches])
+	cmd = f'''update {PRRCubeTbl} set {sets} where department_id is ? and year is ?
+			and month is ? and prr_state is ? and closure_reasons is ?'''
+	curs.executemany(cmd,updList)
+
+def cubeQuantiles(currDB,sketch,qList=(0.5,0.95),groupBy=('department_id',),where='',params=()):
+	'''210501: approximate quantiles of a PRRCubeSketches metric, merging the cells'
+	digests per groupBy, eg rolling p50/p95 close days per department:
+		cubeQuantiles(currDB,'close_days',where='year*12+month >= ?',params=(2020*12+7,))
+	returns {groupKey: [quantile for q in qList]}
+	'''
+
+	whereClause = f'where {where}' if where != '' else ''
+	cmd = f'select {",".join(groupBy)},{sketch}_digest from {PRRCubeTbl} {whereClause}'
+	curs = currDB.cursor()
+	curs.execute(cmd,params)
+
+	mergeTbl = {}
+	for row in curs.fetchall():
+		blob = row[-1]
+		if blob == None:
+			continue
+		key = tuple(row[:-1])
+		digest = TDigest.fromBytes(blob)
+		if key in mergeTbl:
+			mergeTbl[key].merge(digest)
+		else:
+			mergeTbl[key] = digest
+
+	return {key: [digest.quantile(q) for q in qList] for key,digest in mergeTbl.items()}
+
+def rptPRRCube(currDB,outf,byMonth=False):
+	'''210429: department x year (x month) report read directly from PRRCubeTbl
+	department names normalized, cells merged by summing
+	'''
+
+	curs = currDB.cursor()
+	cmd = 'select id,name from department'
+	curs.execute(cmd)
+	normDeptTbl = {deptIdx: normalizeDeptName(name) for deptIdx,name in curs.fetchall()}
+
+	cmd = f'''select department_id,year,month,sum(nprr),sum(nclose),sum(nclose_days),sum(close_days_sum),
+				sum(close_days_sumsq),sum(ndoc_sum),sum(ndoc_sumsq)
+			from {PRRCubeTbl} group by department_id,year,month'''
+	curs.execute(cmd)
+
+	rptTbl = defaultdict(lambda: [0,0,0,0,0,0,0]) # (dept,year[,month]) -> sums
+	for row in curs.fetchall():
+		(deptIdx,year,month) = row[:3]
+		dept = normDeptTbl.get(deptIdx,'') if deptIdx != None else ''
+		key = (dept,year,month) if byMonth else (dept,year)
+		sums = rptTbl[key]
+		for i,val in enumerate(row[3:]):
+			sums[i] += val if val != None else 0
+
+	def meanSD(n,tot,totSq):
+		if n == 0:
+			return (0.,0.)
+		avg = float(tot) / n
+		return (avg,math.sqrt(max(0.,float(totSq) / n - avg*avg)))
+
+	outs = open(outf,'w')
+	hdr = 'Dept,Year,Month,' if byMonth else 'Dept,Year,'
+	hdr += 'NPRR,NClose,AvgCloseDay,SDCloseDay,AvgNDoc,SDNDoc'
+	outs.write(hdr+'\n')
+	for key in sorted(rptTbl.keys(),key=lambda k: tuple('' if v == None else v for v in k)):
+		(nprr,nclose,ncloseDays,cdSum,cdSumSq,ndSum,ndSumSq) = rptTbl[key]
+		avgCloseDays,sdCloseDays = meanSD(ncloseDays,cdSum,cdSumSq)
+		avgNDoc,sdNDoc = meanSD(nprr,ndSum,ndSumSq)
+		line = ','.join([str(k) for k in key])
+		line += f',{nprr},{nclose},{avgCloseDays},{sdCloseDays},{avgNDoc},{sdNDoc}'
+		outs.write(line+'\n')
+	outs.close()
+
+# 210502: daily open / overdue PRR counts per department
+PRRBacklogTbl = 'prr_backlog'
+
+def nrDay(dateStr):
+	"NextRequest timestamp -> proleptic ordinal of its (Oakland local) date"
+	return datetime.date.fromisoformat(dateStr[:10]).toordinal()
+
+@metricFn
+def bldBacklogSeries(currDB,lastDay=None):
+	'''210502: sweep-line daily backlog per department into PRRBacklogTbl
+	a PRR is open on days [request day, closed day), overdue on open days after its
+	due day (ever_overdue carries no date, so isn't used); PRR with several
+	departments count in each, no department -> NULL.
+	Open/close/due events are bucketed into per-department difference arrays
+	and swept with one cumsum: O(NPRR + NDept*NDay), no per-day scan of PRR
+	lastDay: datetime.date to end series; default last request/close day
+	'''
+
+	startTime = time.time()
+	curs = currDB.cursor()
+	cmd = '''select depreq.department_id,prr.request_date,prr.due_date,prr.closed_date
+			from prr left join depreq on depreq.request_id=prr.id
+			where prr.request_date is not null'''
+	curs.execute(cmd)
+	rows = curs.fetchall()
+
+	deptCodes = {}
+	deptCol = np.array([deptCodes.setdefault(row[0],len(deptCodes)) for row in rows],dtype=np.int64)
+	reqDay = np.array([nrDay(row[1]) for row in rows],dtype=np.int64)
+	noDay = np.iinfo(np.int64).max
+	dueDay = np.array([nrDay(row[2]) if row[2] != None else noDay for row in rows],dtype=np.int64)
+	closeDay = np.array([nrDay(row[3]) if row[3] != None else noDay for row in rows],dtype=np.int64)
+
+	firstDay = int(reqDay.min()) if len(rows) > 0 else 0
+	if lastDay == None:
+		known = np.concatenate((reqDay,closeDay[closeDay != noDay]))
+		lastDay = int(known.max()) if len(known) > 0 else firstDay
+	else:
+		lastDay = lastDay.toordinal()
+	nday = lastDay - firstDay + 1
+	ndept = len(deptCodes)
+
+	# difference arrays; one extra column absorbs events after lastDay
+	openDiff = np.zeros((ndept,nday+1),dtype=np.int64)
+	overDiff = np.zeros((ndept,nday+1),dtype=np.int64)
+	firstSeen = np.full(ndept,nday,dtype=np.int64)
+
+	def dayIdx(days):
+		return np.clip(days - firstDay,0,nday)
+
+	isOpen = closeDay > reqDay
+	np.add.at(openDiff,(deptCol[isOpen],dayIdx(reqDay[isOpen])),1)
+	np.add.at(openDiff,(deptCol[isOpen],dayIdx(closeDay[isOpen])),-1)
+
+	overStart = dueDay + 1
+	isOver = isOpen & (dueDay != noDay) & (closeDay > overStart)
+	overStart = np.maximum(overStart,reqDay)
+	np.add.at(overDiff,(deptCol[isOver],dayIdx(overStart[isOver])),1)
+	np.add.at(overDiff,(deptCol[isOver],dayIdx(closeDay[isOver])),-1)
+
+	np.minimum.at(firstSeen,deptCol,dayIdx(reqDay))
+
+	nopen = np.cumsum(openDiff[:,:nday],axis=1)
+	noverdue = np.cumsum(overDiff[:,:nday],axis=1)
+
+	dayStrs = [datetime.date.fromordinal(firstDay+i).isoformat() for i in range(nday)]
+	def seriesRows():
+		for deptID,code in deptCodes.items():
+			openList = nopen[code].tolist()
+			overList = noverdue[code].tolist()
+			for i in range(int(firstSeen[code]),nday):
+				yield (deptID,dayStrs[i],openList[i],overList[i])
+
+	curs.execute('begin')
+	curs.execute(f'drop table if exists {PRRBacklogTbl}')
+	curs.execute(f'create table {PRRBacklogTbl} (department_id INTEGER, day TEXT, nopen INTEGER, noverdue INTEGER)')
+	curs.executemany(f'insert into {PRRBacklogTbl} (department_id,day,nopen,noverdue) values (?,?,?,?)',seriesRows())
+	curs.execute(f'create index {PRRBacklogTbl}_deptDayIdx on {PRRBacklogTbl}(department_id,day)')
+	curs.execute('commit')
+
+	nrow = curs.execute(f'select count(*) from {PRRBacklogTbl}').fetchone()[0]
+	print(f'bldBacklogSeries: NRow={nrow} NDept={ndept} NDay={nday} elapsed={time.time()-startTime:.2f}s')
+
+# 210503: per-PRR event timeline and per-department event transition counts
+PRRTimelineTbl = 'prr_timeline'
+EventTransTbl = 'event_transition'
+
+@metricFn
+def bldPRRTimeline(currDB,batchSize=1000):
+	'''210503: single pass over event ordered by (request_id,created_at), streamed
+	via event_prrIdx, writing each PRR's state intervals to PRRTimelineTbl: the
+	PRR is in event type N's state from event N to event N+1 (last one open ended).
+	Counts of event type -> next event type (first event: from NULL) per department
+	go to EventTransTbl.  Deleted events are skipped; event_type names, depreq kept in memory
+	'''
+
+	startTime = time.time()
+	curs = currDB.cursor()
+	outCurs = currDB.cursor()
+
+	curs.execute('select id,name from event_type')
+	etypeName = dict(curs.fetchall())
+
+	reqDeptTbl = defaultdict(list)
+	curs.execute('select request_id,department_id from depreq')
+	for reqid,deptID in curs.fetchall():
+		reqDeptTbl[reqid].append(deptID)
+
+	outCurs.execute('begin')
+	outCurs.execute(f'drop table if exists {PRRTimelineTbl}')
+	cmd = f'''create table {PRRTimelineTbl} (request_id INTEGER, seq INTEGER, event_id INTEGER,
+			event_type_id INTEGER, event_type TEXT, start_epoch INTEGER, end_epoch INTEGER, duration INTEGER)'''
+	outCurs.execute(cmd)
+	outCurs.execute(f'drop table if exists {EventTransTbl}')
+	cmd = f'''create table {EventTransTbl} (department_id INTEGER, from_type_id INTEGER,
+			to_type_id INTEGER, ntrans INTEGER)'''
+	outCurs.execute(cmd)
+	insCmd = f'''insert into {PRRTimelineTbl} (request_id,seq,event_id,event_type_id,event_type,
+			start_epoch,end_epoch,duration) values (?,?,?,?,?,?,?,?)'''
+
+	cmd = '''select request_id,id,event_type_id,created_at_epoch from event
+			where deleted is not 1 and request_id is not null
+			order by request_id,created_at_epoch,id'''
+	curs.execute(cmd)
+
+	transTbl = defaultdict(int) # (deptID,fromType,toType) -> freq
+	nprr = 0
+	nevent = 0
+	batch = []
+	for reqid,events in itertools.groupby(curs,key=lambda row: row[0]):
+		nprr += 1
+		deptList = reqDeptTbl.get(reqid,[None])
+		prevType = None
+		prev = None
+		seq = 0
+		for (reqid,eventID,etypeID,epoch) in events:
+			nevent += 1
+			for deptID in deptList:
+				transTbl[(deptID,prevType,etypeID)] += 1
+			if prev != None:
+				duration = epoch - prev[3] if epoch != None and prev[3] != None else None
+				batch.append((reqid,seq,prev[1],prev[2],etypeName.get(prev[2]),prev[3],epoch,duration))
+				seq += 1
+			prevType = etypeID
+			prev = (reqid,eventID,etypeID,epoch)
+		batch.append((reqid,seq,prev[1],prev[2],etypeName.get(prev[2]),prev[3],None,None))
+
+		if len(batch) >= batchSize:
+			outCurs.executemany(insCmd,batch)
+			batch = []
+	outCurs.executemany(insCmd,batch)
+
+	cmd = f'insert into {EventTransTbl} (department_id,from_type_id,to_type_id,ntrans) values (?,?,?,?)'
+	outCurs.executemany(cmd,[key+(freq,) for key,freq in transTbl.items()])
+	outCurs.execute(f'create index {PRRTimelineTbl}_prrIdx on {PRRTimelineTbl}(request_id)')
+	outCurs.execute('commit')
+
+	print(f'bldPRRTimeline: NPRR={nprr} NEvent={nevent} NTrans={len(transTbl)} elapsed={time.time()-startTime:.2f}s')
+
+# 210511: per-PRR business-day SLA measures
+PRRSLATbl = 'prr_sla'
+PRRSLA_fields = {
+	'request_id': 'INTEGER PRIMARY KEY',
+	'days_to_close': 'INTEGER',
+	'biz_days_to_close': 'INTEGER',
+	'biz_days_to_contact': 'INTEGER',
+	'biz_days_to_due': 'INTEGER',
+	'biz_days_late': 'INTEGER',
+}
+
+# City of Oakland paid holidays.  Fixed-date ones falling on Saturday are observed
+# the Friday before, on Sunday the Monday after
+OaklandFixedHolidays = [(1,1),(3,31),(7,4),(11,11),(12,25)] # New Year, Cesar Chavez, Independence, Veterans, Christmas
+OaklandNthHolidays = [ # (month, weekday, n): n'th weekday of month, n=-1 last
+	(1,'Mon',3),	# Martin Luther King Jr.
+	(2,'Mon',3),	# Presidents'
+	(5,'Mon',-1),	# Memorial
+	(9,'Mon',1),	# Labor
+	(10,'Mon',2),	# Indigenous Peoples'
+	(11,'Thu',4),	# Thanksgiving
+]
+OaklandJuneteenthYear = 2022 # (6,19) fixed holiday from this year
+
+def oaklandHolidays(firstYear,lastYear):
+	"City of Oakland holidays for [firstYear,lastYear], as sorted datetime64[D] array"
+
+	holidays = []
+	for year in range(firstYear,lastYear+1):
+		fixed = list(OaklandFixedHolidays)
+		if year >= OaklandJuneteenthYear:
+			fixed.append((6,19))
+		for month,day in fixed:
+			hday = datetime.date(year,month,day)
+			if hday.weekday() == 5:
+				hday -= datetime.timedelta(days=1)
+			elif hday.weekday() == 6:
+				hday += datetime.timedelta(days=1)
+			holidays.append(np.datetime64(hday,'D'))
+		for month,weekday,n in OaklandNthHolidays:
+			if n > 0:
+				hday = np.busday_offset(np.datetime64(f'{year}-{month:02d}-01'),n-1,roll='forward',weekmask=weekday)
+			else:
+				nextMonth = np.datetime64(f'{year}-{month:02d}','M') + 1
+				hday = np.busday_offset(nextMonth.astype('datetime64[D]'),n,roll='forward',weekmask=weekday)
+			holidays.append(hday)
+			if (month,weekday) == (11,'Thu'):
+				holidays.append(hday+1) # day after Thanksgiving
+	return np.array(sorted(holidays),dtype='datetime64[D]')
+
+def nrDays(dateStrs):
+	"NextRequest timestamps -> datetime64[D] array of (Oakland local) dates, NaT for None"
+	return np.array([dateStr[:10] if dateStr != None else 'NaT' for dateStr in dateStrs],dtype='datetime64[D]')
+
+def bizDayCount(beginDays,endDays,holidays):
+	'''business days in [begin,end) for each pair (negative if end < begin), as
+	float array with nan where either date is missing; one np.busday_count call
+	'''
+	counts = np.full(len(beginDays),np.nan)
+	ok = ~(np.isnat(beginDays) | np.isnat(endDays))
+	counts[ok] = np.busday_count(beginDays[ok],endDays[ok],holidays=holidays)
+	return counts
+
+@metricFn
+def bldPRRSLA(currDB,holidays=None):
+	'''210511: business-day SLA measures for every PRR into PRRSLATbl, indexed on each measure
+	from request date: biz days to close, to initial contact and to due date;
+	calendar days to close; biz days closed after due date (0 if on time)
+	NB: dates are the (Oakland local) days of the NextRequest timestamps; counts are
+	days in [from,to), so same-day close is 0.  Missing dates give NULL
+	holidays: datetime64[D] array; default oaklandHolidays() over the data's years
+	'''
+
+	startTime = time.time()
+	curs = currDB.cursor()
+
+	cmd = 'select id,request_date,closed_date,initial_contact_date,due_date from prr order by id'
+	curs.execute(cmd)
+	with metricStage('query'):
+		rows = curs.fetchall()
+	if len(rows) == 0:
+		print('bldPRRSLA: no PRR?!')
+		return
+
+	with metricStage('count'):
+		prrIDs,reqDays,closeDays,contactDays,dueDays = zip(*rows)
+		reqDays = nrDays(reqDays)
+		closeDays = nrDays(closeDays)
+		contactDays = nrDays(contactDays)
+		dueDays = nrDays(dueDays)
+
+		if holidays is None:
+			allDays = np.concatenate([reqDays,closeDays,contactDays,dueDays])
+			allDays = allDays[~np.isnat(allDays)]
+			firstYear = allDays.min().astype(object).year
+			lastYear = allDays.max().astype(object).year
+			# NB: a Saturday New Year is observed the Friday before, in lastYear
+			holidays = oaklandHolidays(firstYear,lastYear+1)
+
+		slaCols = {}
+		ok = ~(np.isnat(reqDays) | np.isnat(closeDays))
+		slaCols['days_to_close'] = np.full(len(rows),np.nan)
+		slaCols['days_to_close'][ok] = (closeDays[ok] - reqDays[ok]).astype(np.int64)
+		slaCols['biz_days_to_close'] = bizDayCount(reqDays,closeDays,holidays)
+		slaCols['biz_days_to_contact'] = bizDayCount(reqDays,contactDays,holidays)
+		slaCols['biz_days_to_due'] = bizDayCount(reqDays,dueDays,holidays)
+		slaCols['biz_days_late'] = np.maximum(bizDayCount(dueDays,closeDays,holidays),0)
+
+	fldList = list(PRRSLA_fields.keys())[1:]
+	# NB: nan -> NULL, else python int for sqlite
+	colVals = [[None if math.isnan(v) else int(v) for v in slaCols[fld]] for fld in fldList]
+
+	with metricStage('insert'):
+		curs.execute('begin')
+		curs.execute(f'drop table if exists {PRRSLATbl}')
+		cmd = f'create table {PRRSLATbl} (' + ', '.join(f'{fld} {ftype}' for fld,ftype in PRRSLA_fields.items()) + ')'
+		curs.execute(cmd)
+		cmd = f'insert into {PRRSLATbl} (request_id,{",".join(fldList)}) values ({",".join("?"*(len(fldList)+1))})'
+		curs.executemany(cmd,zip(prrIDs,*colVals))
+		for fld in fldList:
+			curs.execute(f'create index {PRRSLATbl}_{fld}Idx on {PRRSLATbl}({fld})')
+		curs.execute('commit')
+
+	nclose = int(np.sum(~np.isnan(slaCols['biz_days_to_close'])))
+	nlate = int(np.sum(slaCols['biz_days_late'] > 0))
+	medClose = np.nanmedian(slaCols['biz_days_to_close']) if nclose > 0 else 0.
+	print(f'bldPRRSLA: NPRR={len(rows)} NClose={nclose} NLate={nlate} MedBizDaysToClose={medClose} NHoliday={len(holidays)} elapsed={time.time()-startTime:.2f}s')
+
+# 210512: near-duplicate prr.request_text via MinHash signatures + LSH banding
+PRRDupTbl = 'prr_dup'
+PRRMinHashTbl = 'prr_minhash'	# signature cache: request_id, text_hash, sig
+PRRLSHTbl = 'prr_lsh'			# band buckets: band, bucket, request_id
+PRRMinHashMetaTbl = 'prr_minhash_meta'
+MinHashN = 128
+LSHBands = 16			# 16 bands x 8 rows: candidate threshold ~ (1/16)^(1/8) = 0.71
+MinHashSeed = 210512
+MinHashPrime = 4294967311 # > 2^32, so (a*x) % p fits uint64 for 32 bit a,x
+ShingleWords = 3
+
+def textShingles(text):
+	"crc32 of word ShingleWords-grams of normalized text; whole text if shorter; [] if none"
+	words = re.findall(r'[a-z0-9]+',text.lower()) if text != None else []
+	if len(words) == 0:
+		return []
+	if len(words) <= ShingleWords:
+		return [zlib.crc32(' '.join(words).encode())]
+	return list(set(zlib.crc32(' '.join(words[i:i+ShingleWords]).encode()) for i in range(len(words)-ShingleWords+1)))
+
+class MinHasher:
+	'''MinHashN universal hashes (a*x+b) % MinHashPrime, fixed by MinHashSeed so cached
+	signatures stay comparable, and LSHBands band hash multipliers
+	'''
+
+	def __init__(self,nhash=MinHashN,nband=LSHBands,seed=MinHashSeed):
+		rng = np.random.default_rng(seed)
+		self.nhash = nhash
+		self.nband = nband
+		self.nrow = nhash // nband
+		self.a = rng.integers(1,2**32,size=nhash,dtype=np.uint64)
+		self.b = rng.integers(0,2**32,size=nhash,dtype=np.uint64)
+		self.bandMult = rng.integers(1,2**63,size=self.nrow,dtype=np.uint64) | np.uint64(1)
+
+	def sigs(self,shingleLists):
+		'''uint32 signature matrix, one row per (non-empty) shingle list
+		NB: all shingles of the batch hashed by one hash function at a time, so temporaries
+		stay O(total shingles) rather than nhash times that; minimum per list via reduceat
+		'''
+		lens = np.array([len(shingles) for shingles in shingleLists])
+		x = np.fromiter(itertools.chain.from_iterable(shingleLists),dtype=np.uint64,count=int(lens.sum()))
+		offsets = np.concatenate([[0],np.cumsum(lens)[:-1]])
+		sigs = np.empty((len(lens),self.nhash),dtype=np.uint32)
+		hv = np.empty_like(x)
+		for i in range(self.nhash):
+			np.multiply(self.a[i],x,out=hv)
+			hv %= MinHashPrime
+			hv += self.b[i]
+			hv %= MinHashPrime
+			sigs[:,i] = np.minimum.reduceat(hv,offsets)
+		return sigs
+
+	def bandKeys(self,sigs):
+		"int64 bucket key per (signature,band): multiply-add hash of the band's rows"
+		bands = sigs.astype(np.uint64).reshape(len(sigs),self.nband,self.nrow)
+		return (bands * self.bandMult).sum(axis=2).view(np.int64)
+
+	def params(self):
+		return f'{self.nhash},{self.nband},{MinHashSeed},{ShingleWords}'
+
+def textHash(text):
+	"int64 content hash of request_text, to detect edits"
+	return int.from_bytes(hashlib.blake2b((text or '').encode(),digest_size=8).digest(),'little',signed=True)
+
+@metricFn
+def bldPRRDups(currDB,cacheFile=None,minSim=0.7,batchSize=2000):
+	'''210512: cluster near-duplicate prr.request_text into PRRDupTbl
+	(request_id, cluster_id = smallest request_id in cluster, cluster_size), one row per
+	PRR in a cluster of 2 or more.  LSH candidates (PRR sharing a band bucket) are joined
+	if their estimated Jaccard similarity (fraction of equal MinHash rows) >= minSim.
+	Signatures and band buckets are cached in PRRMinHashTbl/PRRLSHTbl and only computed
+	for new or edited request_text; clustering is a linear pass over the buckets.
+	cacheFile: sqlite file for the cache (eg next to prr.db, which bldPRRdb replaces);
+		default currDB
+	'''
+
+	startTime = time.time()
+	curs = currDB.cursor()
+	schema = 'main'
+	if cacheFile != None:
+		schema = 'mhcache'
+		curs.execute(f"attach database ? as {schema}",(cacheFile,))
+
+	hasher = MinHasher()
+	curs.execute('begin')
+	curs.execute(f'create table if not exists {schema}.{PRRMinHashMetaTbl} (param TEXT PRIMARY KEY, value TEXT)')
+	curs.execute(f"select value from {schema}.{PRRMinHashMetaTbl} where param='params'")
+	row = curs.fetchone()
+	if row == None or row[0] != hasher.params():
+		# NB: new or incompatible cache
+		curs.execute(f'drop table if exists {schema}.{PRRMinHashTbl}')
+		curs.execute(f'drop table if exists {schema}.{PRRLSHTbl}')
+		curs.execute(f"insert or replace into {schema}.{PRRMinHashMetaTbl} (param,value) values ('params',?)",(hasher.params(),))
+	curs.execute(f'create table if not exists {schema}.{PRRMinHashTbl} (request_id INTEGER PRIMARY KEY, text_hash INTEGER, sig BLOB)')
+	curs.execute(f'create table if not exists {schema}.{PRRLSHTbl} (band INTEGER, bucket INTEGER, request_id INTEGER)')
+	curs.execute(f'create index if not exists {schema}.{PRRLSHTbl}_bucketIdx on {PRRLSHTbl}(band,bucket)')
+	curs.execute(f'create index if not exists {schema}.{PRRLSHTbl}_prrIdx on {PRRLSHTbl}(request_id)')
+	curs.execute('commit')
+
+	with metricStage('cache'):
+		curs.execute(f'select request_id,text_hash from {schema}.{PRRMinHashTbl}')
+		cachedHash = dict(curs.fetchall())
+
+	curs.execute('select id,request_text from prr order by id')
+	staleIDs = []
+	newRows = [] # (request_id,text_hash,shingles)
+	nsame = 0
+	for prrIdx,text in curs.fetchall():
+		thash = textHash(text)
+		oldHash = cachedHash.pop(prrIdx,None)
+		if oldHash == thash:
+			nsame += 1
+			continue
+		if oldHash != None:
+			staleIDs.append(prrIdx)
+		newRows.append((prrIdx,thash,textShingles(text)))
+	# NB: whatever remains cached has left prr
+	staleIDs += list(cachedHash.keys())
+
+	curs.execute('begin')
+	for chunk in range(0,len(staleIDs),batchSize):
+		delIDs = [(prrIdx,) for prrIdx in staleIDs[chunk:chunk+batchSize]]
+		curs.executemany(f'delete from {schema}.{PRRMinHashTbl} where request_id=?',delIDs)
+		curs.executemany(f'delete from {schema}.{PRRLSHTbl} where request_id=?',delIDs)
+
+	nsig = 0
+	for chunk in range(0,len(newRows),batchSize):
+		batch = newRows[chunk:chunk+batchSize]
+		# NB: empty text: cached (so not redone) with NULL sig, never clustered
+		curs.executemany(f'insert into {schema}.{PRRMinHashTbl} (request_id,text_hash,sig) values (?,?,NULL)',
+						[(prrIdx,thash) for prrIdx,thash,shingles in batch if len(shingles) == 0])
+		batch = [row for row in batch if len(row[2]) > 0]
+		if len(batch) == 0:
+			continue
+		with metricStage('minhash'):
+			sigs = hasher.sigs([shingles for prrIdx,thash,shingles in batch])
+			keys = hasher.bandKeys(sigs)
+		curs.executemany(f'insert into {schema}.{PRRMinHashTbl} (request_id,text_hash,sig) values (?,?,?)',
+						[(prrIdx,thash,sig.tobytes()) for (prrIdx,thash,shingles),sig in zip(batch,sigs)])
+		curs.executemany(f'insert into {schema}.{PRRLSHTbl} (band,bucket,request_id) values (?,?,?)',
+						[(band,int(keys[i,band]),batch[i][0]) for i in range(len(batch)) for band in range(hasher.nband)])
+		nsig += len(batch)
+	curs.execute('commit')
+
+	# cluster: union-find over bucket co-members that pass minSim
+	parent = {}
+	def find(x):
+		root = x
+		while parent.get(root,root) != root:
+			root = parent[root]
+		while x != root:
+			parent[x],x = root,parent[x]
+		return root
+
+	sigCache = {}
+	def getSig(prrIdx):
+		if prrIdx not in sigCache:
+			curs2.execute(f'select sig from {schema}.{PRRMinHashTbl} where request_id=?',(prrIdx,))
+			sigCache[prrIdx] = np.frombuffer(curs2.fetchone()[0],dtype=np.uint32)
+		return sigCache[prrIdx]
+
+	ncand = 0
+	curs2 = currDB.cursor()
+	cmd = f'''select band,bucket,request_id from {schema}.{PRRLSHTbl}
+			where (band,bucket) in (select band,bucket from {schema}.{PRRLSHTbl} group by band,bucket having count(*) > 1)
+			order by band,bucket,request_id'''
+	curs.execute(cmd)
+	with metricStage('cluster'):
+		for key,members in itertools.groupby(curs,key=lambda row: row[:2]):
+			members = [row[2] for row in members]
+			first = members[0]
+			for prrIdx in members[1:]:
+				ncand += 1
+				rootA,rootB = find(first),find(prrIdx)
+				if rootA == rootB:
+					continue
+				if np.mean(getSig(first) == getSig(prrIdx)) >= minSim:
+					parent[max(rootA,rootB)] = min(rootA,rootB)
+
+	clusters = defaultdict(list)
+	for prrIdx in parent:
+		clusters[find(prrIdx)].append(prrIdx)
+	dupRows = []
+	for clusterID,members in clusters.items():
+		members = set(members) | {clusterID}
+		for prrIdx in members:
+			dupRows.append((prrIdx,clusterID,len(members)))
+
+	curs.execute('begin')
+	curs.execute(f'drop table if exists {PRRDupTbl}')
+	curs.execute(f'create table {PRRDupTbl} (request_id INTEGER PRIMARY KEY, cluster_id INTEGER, cluster_size INTEGER)')
+	curs.executemany(f'insert into {PRRDupTbl} (request_id,cluster_id,cluster_size) values (?,?,?)',sorted(dupRows))
+	curs.execute(f'create index {PRRDupTbl}_clusterIdx on {PRRDupTbl}(cluster_id)')
+	curs.execute('commit')
+	if cacheFile != None:
+		curs.execute(f'detach database {schema}')
+
+	print(f'bldPRRDups: NSame={nsame} NNewSig={nsig} NStale={len(staleIDs)} NCand={ncand} NCluster={len(clusters)} NDupPRR={len(dupRows)} elapsed={time.time()-startTime:.2f}s')
+
+def matchPRRText(currDB,text,minSim=0.7,cacheFile=None):
+	'''210512: PRR whose cached request_text signature is near text: [(request_id,simEst)]
+	via the band buckets of bldPRRDups' cache, best first
+	'''
+
+	shingles = textShingles(text)
+	if len(shingles) == 0:
+		return []
+	hasher = MinHasher()
+	sig = hasher.sigs([shingles])
+	keys = hasher.bandKeys(sig)[0]
+
+	curs = currDB.cursor()
+	schema = 'main'
+	if cacheFile != None:
+		schema = 'mhcache'
+		curs.execute(f"attach database ? as {schema}",(cacheFile,))
+	cmd = f'''select distinct m.request_id,m.sig from {schema}.{PRRLSHTbl} l
+			join {schema}.{PRRMinHashTbl} m on m.request_id=l.request_id
+			where (l.band,l.bucket) in ({",".join(["(?,?)"]*hasher.nband)})'''
+	curs.execute(cmd,[v for band in range(hasher.nband) for v in (band,int(keys[band]))])
+	matches = []
+	for prrIdx,sigBytes in curs.fetchall():
+		sim = float(np.mean(np.frombuffer(sigBytes,dtype=np.uint32) == sig[0]))
+		if sim >= minSim:
+			matches.append((prrIdx,sim))
+	if cacheFile != None:
+		curs.execute(f'detach database {schema}')
+	return sorted(matches,key=lambda m: (-m[1],m[0]))
+
+# 210504: bldIndexTblCSV parse cache, next to the CSV
+CSVCacheSfx = '.cache'
+# NB: bump whenever parseIndexTblCSV's records change, so older caches are reparsed
+# 210507: 2, parseCSVDate: tz-aware closeDate, PST/PDT rather than LMT
+# 210508: 3, DeptNormalizer: canonical dept name resolution
+CSVCacheVersion = 3
+
+def csvCacheKey(inf,startDate=None,endDate=None,compact=False):
+	"content hash of inf + date window + DeptTbl_SD, DeptFuzzyMinSim (+ prrTbl form) + CSVCacheVersion, as hex"
+
+	keyHash = hashlib.sha256()
+	with open(inf,'rb') as inStr:
+		for chunk in iter(lambda: inStr.read(2**20),b''):
+			keyHash.update(chunk)
+	keyHash.update(repr((startDate,endDate)).encode())
+	keyHash.update(repr(sorted(DeptTbl_SD.items())).encode())
+	keyHash.update(repr(DeptFuzzyMinSim).encode())
+	if compact:
+		keyHash.update(b'PRRStore')
+	keyHash.update(f'CSVCacheVersion={CSVCacheVersion}'.encode())
+	return keyHash.hexdigest()
+
+@metricFn
+def bldIndexTblCSV(inf,startDate=None,endDate=None,useCache=True,compact=True):
 	'''210416:  return prrIDTbl ONLY 
 				make consistent with bldPRRdb
+	210504: useCache: reuse the parse saved in inf+CSVCacheSfx if the CSV's content,
+			startDate/endDate, DeptTbl_SD and CSVCacheVersion all match; else parse and (re)write it
+	210506: compact: return prrTbl as PRRStore rather than dict
 	'''
 
+	if useCache:
+		cacheKey = csvCacheKey(inf,startDate,endDate,compact)
+		cacheFile = inf + CSVCacheSfx
+		if os.path.exists(cacheFile):
+			try:
+				with open(cacheFile,'rb') as inStr:
+					cached = pickle.load(inStr)
+				# NB: caches from before CSVCacheVersion are 3-tuples
+				if len(cached) == 4 and cached[0] == CSVCacheVersion:
+					(_,cachedKey,prrTbl,stats) = cached
+				else:
+					print(f'bldIndexTblCSV: stale cache version {cacheFile}')
+					cachedKey = None
+			except Exception as e:
+				print(f'bldIndexTblCSV: bad cache {cacheFile}?! {e}')
+				cachedKey = None
+			if cachedKey == cacheKey:
+				print(f'bldIndexTblCSV: from cache {cacheFile}')
+				rptIndexTblCSV(prrTbl,stats,startDate)
+				return prrTbl
+
+	prrTbl,stats = parseIndexTblCSV(inf,startDate,endDate,compact)
+	rptIndexTblCSV(prrTbl,stats,startDate)
+
+	if useCache:
+		tmpFile = cacheFile + '.tmp'
+		with open(tmpFile,'wb') as outStr:
+			pickle.dump((CSVCacheVersion,cacheKey,prrTbl,stats),outStr,protocol=pickle.HIGHEST_PROTOCOL)
+		os.replace(tmpFile,cacheFile)
+
+	return prrTbl
+
+def rptIndexTblCSV(prrTbl,stats,startDate=None):
+	print('bldIndexTblCSV: NPRR=%d NMissDept=%d NMultDept=%d NCloseDate=%d' % \
+		(len(prrTbl),stats['nmissDept'],stats['nmultDept'],stats['ncloseDate']))
+	if startDate != None:
+		print(f'bldIndexTblCSV: NOld={stats["nolder"]} NRecent={stats["nrecent"]}')
+
+@metricFn
+def parseIndexTblCSV(inf,startDate=None,endDate=None,compact=False):
+	'''parse requests CSV into prrTbl (see bldIndexTblCSV)
+	returns (prrTbl,stats)
+	'''
+
+	stats = {}
+	if compact:
+		prrTbl = PRRStore(iterIndexTblCSV(inf,startDate,endDate,stats))
+		return prrTbl,stats
+
 	prrTbl = {}
-	statusTbl = defaultdict(int)
-	reqCoTbl = defaultdict(list)
-	ncloseDate = 0
-	nolder = 0
-	nrecent = 0
-	nmultDept = 0
-	nmissDept = 0
-	deptSepChar = b'\xef\xbf\xbd' # only used in Finance
-	FinanceEmChar = '�'
-	EmChar = '—'
+	for prr in iterIndexTblCSV(inf,startDate,endDate,stats):
+		prrTbl[prr['id']] = prr
+	
+	return prrTbl,stats
+
+def iterIndexTblCSV(inf,startDate=None,endDate=None,stats=None):
+	'''210505: stream normalized PRR records from requests CSV one at a time
+	stats: dict filled as records are read; complete once exhausted:
+		nmissDept,nmultDept,ncloseDate,nolder,nrecent,
+		statusTbl: status -> freq, deptTbl: normalized dept -> freq
+	'''
+
+	if stats == None:
+		stats = {}
+	for cnt in ('ncloseDate','nolder','nrecent','nmultDept','nmissDept'):
+		stats[cnt] = 0
+	statusTbl = stats['statusTbl'] = defaultdict(int)
+	deptTbl = stats['deptTbl'] = defaultdict(int)
 	
 	reader = csv.DictReader(open(inf,encoding = "utf8",errors='replace'))
 	for i,entry in enumerate(reader):
@@ -651,8 +2445,7 @@ def bldIndexTblCSV(inf,startDate=None,endDate=None):
 		if createDateStr == '':
 			createDate = None
 		else:
-			createDate = datetime.datetime.strptime(createDateStr,CSVDTFormat2)
-			createDate = createDate.replace(tzinfo=OaklandTimeZone)
+			createDate = parseCSVDate(createDateStr)
 			
 		prr['createDate'] = createDate
 		
@@ -660,16 +2453,15 @@ def bldIndexTblCSV(inf,startDate=None,endDate=None):
 		if reqDateStr == '':
 			reqdate = None
 		else:
-			reqdate = datetime.datetime.strptime(reqDateStr,CSVDTFormat2)
-			reqdate = reqdate.replace(tzinfo=OaklandTimeZone)
+			reqdate = parseCSVDate(reqDateStr)
 		
 		minDate = min(createDate,reqdate)
 		maxDate = max(createDate,reqdate)
 		if startDate != None and minDate < startDate:
-			nolder += 1
+			stats['nolder'] += 1
 			continue
 		if endDate != None and maxDate >= endDate:
-			nrecent += 1
+			stats['nrecent'] += 1
 			continue
 		
 		deptStr = entry['Departments'].strip()
@@ -677,48 +2469,293 @@ def bldIndexTblCSV(inf,startDate=None,endDate=None):
 		if deptStr.find(';') == -1:
 			if deptStr == '':
 				deptList = []
-				nmissDept += 1
+				stats['nmissDept'] += 1
 			else:
 				deptList = [deptStr]
 		else:
-			nmultDept += 1
+			stats['nmultDept'] += 1
 			deptList = [dept.strip() for dept in deptStr.split(';')]
 		
 		# Normalize department names	
 		deptList2 = []
 		for dept in deptList:
-			dept = dept.replace(FinanceEmChar,EmChar)
 			ndept = normalizeDeptName(dept)
 			if ndept != '':
 				deptList2.append(ndept)
+				deptTbl[ndept] += 1
 		prr['dept'] = deptList2
 			
 		closeDateStr = entry['Closed Date'].strip()
-		prr['closeDate'] = datetime.datetime.strptime(closeDateStr,CSVDTFormat2)  if closeDateStr != '' else None
+		prr['closeDate'] = parseCSVDate(closeDateStr)  if closeDateStr != '' else None
 		prr['status'] = entry['Status'].strip()
 		prr['text'] = entry['Request Text'].strip()
 		prr['closeReason'] = entry['Closure Reasons'].strip()
 		prr['URL'] = entry['URL'].strip()
 		prr['requestCo'] = entry['Requester Company'].strip()
 		
-		if prr['requestCo'] in ("","N/A","n/a","NA","None","none"):
+		if prr['requestCo'] in NullRequesterCo:
 			prr['requestCo'] = None
-		else:
-			reqCoTbl[ prr['requestCo'] ].append(prrID)
 		
 		statusTbl[ prr['status'] ] += 1
 		if prr['closeDate'] != None:
-			ncloseDate += 1
+			stats['ncloseDate'] += 1
 						
-		prrTbl[prrID] = prr
-		
-	print('bldIndexTblCSV: NPRR=%d NMissDept=%d NMultDept=%d NCloseDate=%d' % \
-		(len(prrTbl),nmissDept,nmultDept,ncloseDate))
-	if startDate != None:
-		print(f'bldIndexTblCSV: NOld={nolder} NRecent={nrecent}')
-	
-	return prrTbl
+		yield prr
+
+	deptNormalizer().report('iterIndexTblCSV')
 		
+class PRRStore(Mapping):
+	'''210506: compact columnar prrTbl, drop-in for the dict of PRR records
+	built by parseIndexTblCSV(): pretty_id -> record
+	dates held as int64 wall-clock seconds (NoDate for missing), status,
+	closeReason, requestCo and dept integer coded against shared name lists,
+	dept lists as offsets into one code array; records rebuilt on access
+	'''
+
+	NoDate = np.iinfo(np.int64).min
+	DateFlds = ('createDate','closeDate')
+	CodeFlds = ('status','closeReason','requestCo')
+	TextFlds = ('text','URL')
+	Epoch0 = datetime.datetime(1970,1,1)
+
+	def __init__(self,prrIter=()):
+		self.index = {} # pretty_id -> row
+		self.ids = []
+		self.names = {fld: [] for fld in self.CodeFlds+('dept',)}
+		self.nameIdx = {fld: {} for fld in self.CodeFlds+('dept',)}
+		self.dates = {fld: [] for fld in self.DateFlds}
+		self.codes = {fld: [] for fld in self.CodeFlds}
+		self.texts = {fld: [] for fld in self.TextFlds}
+		self.deptOff = [0]
+		self.deptCode = []
+		self.frozen = False
+		for prr in prrIter:
+			self.add(prr)
+		self.freeze()
+
+	def code(self,fld,name):
+		nameIdx = self.nameIdx[fld]
+		if name not in nameIdx:
+			nameIdx[name] = len(self.names[fld])
+			self.names[fld].append(name)
+		return nameIdx[name]
+
+	def add(self,prr):
+		if self.frozen:
+			raise ValueError('PRRStore.add: store is frozen')
+
+		prrID = prr['id']
+		# NB: repeated id: later record replaces earlier but keeps its position,
+		#	as in dict prrTbl; earlier row is left unindexed
+		self.index[prrID] = len(self.ids)
+		self.ids.append(prrID)
+		for fld in self.DateFlds:
+			dt = prr[fld]
+			self.dates[fld].append(self.NoDate if dt == None else \
+				(dt.replace(tzinfo=None) - self.Epoch0) // datetime.timedelta(seconds=1))
+		for fld in self.CodeFlds:
+			self.codes[fld].append(self.code(fld,prr[fld]))
+		for fld in self.TextFlds:
+			self.texts[fld].append(prr[fld])
+		self.deptCode.extend([self.code('dept',dept) for dept in prr['dept']])
+		self.deptOff.append(len(self.deptCode))
+
+	def freeze(self):
+		'''convert build lists to numpy arrays'''
+		if self.frozen:
+			return
+		for fld in self.DateFlds:
+			self.dates[fld] = np.array(self.dates[fld],dtype=np.int64)
+		for fld in self.CodeFlds:
+			self.codes[fld] = np.array(self.codes[fld],dtype=self.codeType(len(self.names[fld])))
+		self.deptCode = np.array(self.deptCode,dtype=self.codeType(len(self.names['dept'])))
+		self.deptOff = np.array(self.deptOff,dtype=np.int32)
+		self.nameIdx = None
+		self.frozen = True
+
+	@staticmethod
+	def codeType(ncode):
+		return np.int8 if ncode < 2**7 else (np.int16 if ncode < 2**15 else np.int32)
+
+	def date(self,fld,row):
+		secs = int(self.dates[fld][row])
+		if secs == self.NoDate:
+			return None
+		dt = self.Epoch0 + datetime.timedelta(seconds=secs)
+		return OaklandTimeZone.localize(dt)
+
+	def record(self,row):
+		prr = {'id': self.ids[row]}
+		prr['createDate'] = self.date('createDate',row)
+		deptNames = self.names['dept']
+		prr['dept'] = [deptNames[c] for c in self.deptCode[self.deptOff[row]:self.deptOff[row+1]]]
+		prr['closeDate'] = self.date('closeDate',row)
+		for fld in self.CodeFlds:
+			prr[fld] = self.names[fld][self.codes[fld][row]]
+		for fld in self.TextFlds:
+			prr[fld] = self.texts[fld][row]
+		return prr
+
+	def __getitem__(self,prrID):
+		return self.record(self.index[prrID])
+
+	def __contains__(self,prrID):
+		return prrID in self.index
+
+	def __iter__(self):
+		return iter(self.index)
+
+	def __len__(self):
+		return len(self.index)
+
+	def rows(self,prrID):
+		'''row number for column access, eg store.dates['closeDate'][store.rows(id)]'''
+		return self.index[prrID]
+
+	def nbytes(self):
+		'''approximate bytes held, excluding the shared name lists'''
+		nb = sum(sys.getsizeof(s) for s in self.ids) + sys.getsizeof(self.ids) + sys.getsizeof(self.index)
+		for fld in self.TextFlds:
+			nb += sys.getsizeof(self.texts[fld]) + sum(sys.getsizeof(s) for s in self.texts[fld])
+		for arr in list(self.dates.values()) + list(self.codes.values()) + [self.deptCode,self.deptOff]:
+			nb += arr.nbytes
+		return nb
+
+# 210513: normalized requester companies (CSV 'Requester Company') linked to PRR
+RequesterCoTbl = 'requester_co'		# id, norm_name, display_name
+PRRRequesterTbl = 'prr_requester'	# pretty_id, request_id, requester_co_id, raw_name
+NullRequesterCo = ("","N/A","n/a","NA","None","none")
+RequesterCoSfx = {'inc','incorporated','llc','llp','lp','ltd','corp','corporation','co','company','pc','the'}
+
+def normRequesterCo(name):
+	'''requester company -> normalized key: lower case, & -> and, punctuation dropped,
+	leading "the" and trailing corporate suffixes removed; None for NullRequesterCo/empty
+	'''
+	if name == None or name.strip() in NullRequesterCo:
+		return None
+	words = re.findall(r'[a-z0-9]+',name.lower().replace('&',' and '))
+	while len(words) > 1 and words[-1] in RequesterCoSfx:
+		words.pop()
+	if len(words) > 1 and words[0] == 'the':
+		words.pop(0)
+	return ' '.join(words) if len(words) > 0 else None
+
+@metricFn
+def bldRequesterTbl(currDB,prrCSV,dropExisting=False,batchSize=1000):
+	'''210513: upsert requester company of CSV PRR records into PRRRequesterTbl,
+	one row per pretty_id, with companies in RequesterCoTbl (first raw spelling seen is
+	the display_name).  request_id is the prr.id with that pretty_id, NULL if none.
+	prrCSV: record stream (eg iterIndexTblCSV) or prrTbl; records replace earlier rows
+	for the same pretty_id so later exports update in place.  dropExisting: rebuild
+	'''
+
+	startTime = time.time()
+	curs = currDB.cursor()
+	curs.execute('begin')
+	if dropExisting:
+		curs.execute(f'drop table if exists {RequesterCoTbl}')
+		curs.execute(f'drop table if exists {PRRRequesterTbl}')
+	curs.execute(f'create table if not exists {RequesterCoTbl} (id INTEGER PRIMARY KEY, norm_name TEXT UNIQUE, display_name TEXT)')
+	cmd = f'''create table if not exists {PRRRequesterTbl} (pretty_id TEXT PRIMARY KEY, request_id INTEGER,
+			requester_co_id INTEGER, raw_name TEXT)'''
+	curs.execute(cmd)
+	curs.execute(f'create index if not exists {PRRRequesterTbl}_coIdx on {PRRRequesterTbl}(requester_co_id,request_id)')
+	curs.execute(f'create index if not exists {PRRRequesterTbl}_prrIdx on {PRRRequesterTbl}(request_id)')
+
+	curs.execute(f'select norm_name,id from {RequesterCoTbl}')
+	coIdx = dict(curs.fetchall())
+	ncoOld = len(coIdx)
+	curs.execute('select pretty_id,id from prr')
+	prrIdx = dict(curs.fetchall())
+
+	if isinstance(prrCSV,Mapping):
+		prrCSV = prrCSV.values()
+
+	insCo = f'insert into {RequesterCoTbl} (id,norm_name,display_name) values (?,?,?)'
+	insReq = f'insert or replace into {PRRRequesterTbl} (pretty_id,request_id,requester_co_id,raw_name) values (?,?,?,?)'
+	nrow = 0
+	nco = 0
+	nmissPRR = 0
+	batch = []
+	for prr in metricIter('csv',prrCSV):
+		rawName = prr['requestCo']
+		normName = normRequesterCo(rawName)
+		coID = None
+		if normName != None:
+			if normName not in coIdx:
+				coIdx[normName] = len(coIdx) + 1
+				curs.execute(insCo,(coIdx[normName],normName,rawName.strip()))
+			coID = coIdx[normName]
+			nco += 1
+		reqID = prrIdx.get(prr['id'])
+		if reqID == None:
+			nmissPRR += 1
+		batch.append((prr['id'],reqID,coID,rawName))
+		if len(batch) == batchSize:
+			curs.executemany(insReq,batch)
+			nrow += len(batch)
+			batch = []
+	curs.executemany(insReq,batch)
+	nrow += len(batch)
+	curs.execute('commit')
+
+	print(f'bldRequesterTbl: NRow={nrow} NWithCo={nco} NMissPRR={nmissPRR} NCo={len(coIdx)} NNewCo={len(coIdx)-ncoOld} elapsed={time.time()-startTime:.2f}s')
+
+def topRequesters(currDB,k=10,deptID=None,year=None,openOnly=False):
+	'''210513: top-k requester companies by number of PRR: [(display_name,nprr)]
+	deptID: only PRR assigned to that department; year: request_date_year;
+	openOnly: only PRR not Closed (who drives the backlog)
+	'''
+
+	joins = ''
+	where = []
+	params = []
+	if deptID != None:
+		joins += ' join depreq on depreq.request_id=r.request_id'
+		where.append('depreq.department_id=?')
+		params.append(deptID)
+	if year != None or openOnly:
+		joins += ' join prr on prr.id=r.request_id'
+	if year != None:
+		where.append('prr.request_date_year=?')
+		params.append(year)
+	if openOnly:
+		where.append("prr.prr_state != 'Closed'")
+	whereSQL = ('where ' + ' and '.join(where)) if len(where) > 0 else 'where r.request_id is not null'
+
+	# NB: count distinct: a PRR may appear once per department
+	cmd = f'''select c.display_name,count(distinct r.request_id) as nprr
+			from {PRRRequesterTbl} r join {RequesterCoTbl} c on c.id=r.requester_co_id {joins}
+			{whereSQL}
+			group by r.requester_co_id order by nprr desc,c.display_name limit ?'''
+	curs = currDB.cursor()
+	curs.execute(cmd,params+[k])
+	return curs.fetchall()
+
+def rptRequesters(currDB,outf,k=10):
+	'''210513: top-k requester companies overall, open PRR, and for each year and department
+	Group,Rank,Company,NPRR
+	'''
+
+	curs = currDB.cursor()
+	curs.execute('select distinct request_date_year from prr where request_date_year is not null order by 1')
+	years = [row[0] for row in curs.fetchall()]
+	curs.execute('select id,name from department order by id')
+	depts = curs.fetchall()
+
+	groups = [('all',{}),('open',{'openOnly': True})]
+	groups += [(f'{year}',{'year': year}) for year in years]
+	groups += [(name,{'deptID': deptIdx}) for deptIdx,name in depts]
+
+	# NB: company and dept names may hold quotes and commas
+	outs = open(outf,'w',newline='')
+	writer = csv.writer(outs)
+	writer.writerow(['Group','Rank','Company','NPRR'])
+	for group,kwargs in groups:
+		for rank,(company,nprr) in enumerate(topRequesters(currDB,k,**kwargs)):
+			writer.writerow([group,rank+1,company,nprr])
+	outs.close()
+
 def loadDept_SD(inf):
 	'''load SD's curated department list
 	deptTbl: name -> {deptID,normName,desc,poc_id}
@@ -739,68 +2776,201 @@ def loadDept_SD(inf):
 									'poc_id':   entry['poc_id']}	
 	return deptTbl
 
+class DeptNormalizer:
+	'''210508: department name -> SD's normalized name, from loadDept_SD() output
+	lookup order: memo, exact name, canonical form (case, whitespace and the
+	dash variants incl. the mangled Finance em-dash), then optional fuzzy match on
+	character n-gram Jaccard similarity via an inverted n-gram index.
+	Unresolved names pass through unchanged and are counted for report()
+	210516: fuzzy matching is opt-in (minSim=None: off); n-gram overlap alone
+	merges unrelated depts, eg 'Oakland Parks Department' -> Police at 0.6.
+	If on, the best match must reach minSim (0.7 accepts a one character typo in
+	a longer name, eg 'Polce Department' at 0.74) and beat the best other dept
+	by minMargin.  Otherwise the best match is only suggested by report()
+	'''
+
+	DashChars = '�—–-'
+
+	def __init__(self,deptTbl,minSim=None,minMargin=0.1,ngram=3):
+		self.deptTbl = deptTbl
+		self.minSim = minSim
+		self.minMargin = minMargin
+		self.ngram = ngram
+		self.memo = {} # name -> (normName,how)
+		self.suggest = {} # unresolved name -> (normName,sim) best fuzzy candidate
+		self.canonTbl = {} # canonical name -> normName
+		self.gramIdx = defaultdict(set) # ngram -> canonical names
+		self.gramLen = {} # canonical name -> number of distinct ngrams
+		self.freq = defaultdict(lambda: defaultdict(int)) # how -> name -> freq
+		self.reported = set()
+
+		for name,info in deptTbl.items():
+			self.memo[name] = (info['normName'],'exact')
+		for name,info in deptTbl.items():
+			# NB: already normalized names map to themselves
+			self.memo.setdefault(info['normName'],(info['normName'],'exact'))
+		for name,info in deptTbl.items():
+			for key in (name,info['normName']):
+				canon = self.canon(key)
+				# NB: first entry wins, as for loadDept_SD's dup names
+				self.canonTbl.setdefault(canon,info['normName'])
+
+		for canon in self.canonTbl:
+			grams = self.grams(canon)
+			self.gramLen[canon] = len(grams)
+			for gram in grams:
+				self.gramIdx[gram].add(canon)
+
+	def canon(self,name):
+		name = name.lower()
+		for dash in self.DashChars:
+			name = name.replace(dash,' - ')
+		return ' '.join(name.split())
+
+	def grams(self,canon):
+		padded = f' {canon} '
+		return set(padded[i:i+self.ngram] for i in range(max(1,len(padded)-self.ngram+1)))
+
+	def fuzzy(self,canon):
+		'''(best canonical name,its similarity,best similarity of any other normName)
+		over the n-gram index, or (None,0.,0.)
+		'''
+		grams = self.grams(canon)
+		overlap = defaultdict(int)
+		for gram in grams:
+			for cand in self.gramIdx.get(gram,()):
+				overlap[cand] += 1
+		bestCand,bestSim = None,0.
+		sims = {}
+		for cand,nshare in overlap.items():
+			sim = nshare / (len(grams) + self.gramLen[cand] - nshare)
+			sims[cand] = sim
+			# NB: ties broken by name for a deterministic result
+			if sim > bestSim or (sim == bestSim and bestCand != None and cand < bestCand):
+				bestCand,bestSim = cand,sim
+		if bestCand == None:
+			return None,0.,0.
+		bestNorm = self.canonTbl[bestCand]
+		otherSim = max((sim for cand,sim in sims.items() if self.canonTbl[cand] != bestNorm),default=0.)
+		return bestCand,bestSim,otherSim
+
+	def resolve(self,name):
+		canon = self.canon(name)
+		if canon in self.canonTbl:
+			return self.canonTbl[canon],'canon'
+		cand,sim,otherSim = self.fuzzy(canon)
+		if cand == None:
+			return name,'miss'
+		if self.minSim != None and sim >= self.minSim and sim - otherSim >= self.minMargin:
+			return self.canonTbl[cand],'fuzzy'
+		self.suggest[name] = (self.canonTbl[cand],sim)
+		return name,'miss'
+
+	def __call__(self,name):
+		if name not in self.memo:
+			self.memo[name] = self.resolve(name)
+		normName,how = self.memo[name]
+		if how != 'exact':
+			self.freq[how][name] += 1
+		return normName
+
+	def report(self,caller='DeptNormalizer'):
+		'''print canonical/fuzzy matches and unresolved names not yet reported, with row counts;
+		unresolved names show their best fuzzy candidate, which is not applied
+		'''
+		for how in ('canon','fuzzy','miss'):
+			for name in sorted(self.freq[how].keys() - self.reported):
+				if how == 'miss':
+					sugg = ''
+					if name in self.suggest:
+						sugg = ' (suggest: %s sim=%.3f)' % self.suggest[name]
+					print(f'{caller}: missing dept name?! {name} N={self.freq[how][name]}{sugg}')
+				else:
+					print(f'{caller}: {how} dept {name} -> {self.memo[name][0]} N={self.freq[how][name]}')
+				self.reported.add(name)
+
+DeptNorm = None
+DeptFuzzyMinSim = None # shared normalizer's minSim; eg 0.7 enables fuzzy dept matching
+
+def deptNormalizer():
+	'''shared DeptNormalizer over global DeptTbl_SD with minSim=DeptFuzzyMinSim,
+	rebuilt if either is replaced.  Fuzzy matching is off by default; enable it
+	pipeline-wide by setting oakPRR.DeptFuzzyMinSim (eg 0.7)
+	'''
+	global DeptNorm
+	if DeptNorm == None or DeptNorm.deptTbl is not DeptTbl_SD or DeptNorm.minSim != DeptFuzzyMinSim:
+		DeptNorm = DeptNormalizer(DeptTbl_SD,minSim=DeptFuzzyMinSim)
+	return DeptNorm
+
 def normalizeDeptName(dept):
-	
-	if dept not in DeptTbl_SD:
-		print(f'normalizeDeptName: missing dept name?! {dept}')
-		return dept
-		
-	ndept = DeptTbl_SD[dept]['normName']
-	
-	return ndept
+	'''210508: via deptNormalizer(); unresolved names are returned unchanged and
+	summarized by deptNormalizer().report() rather than printed per row
+	'''
+	return deptNormalizer()(dept)
 
+@metricFn
 def anlyzRedact(currDB,outdir):
 	'''evaluate redaction: contrast CLOSED PRR w/ documents with/out "redaction" in title
+	210426: set-based; first department and document counts per PRR come from
+			grouped SQL joined to prr in one ordered pass, department names
+			from a preloaded map.  Years come from the data
+	210430: per dept/year stats via groupStats over whole columns; adds median/p90 close days
 	'''
 
+	addEpochCols(currDB)
+
 	curs = currDB.cursor()
-	cmd = 'select id,pretty_id,request_date,created_at,closed_date,closure_reasons,prr_state from prr'
+
+	cmd = 'select id,name from department'
+	curs.execute(cmd)
+	deptNameTbl = dict(curs.fetchall())
+	normDeptTbl = {deptIdx: normalizeDeptName(name) for deptIdx,name in deptNameTbl.items()}
+	deptNormalizer().report('anlyzRedact')
+
+	# NB: min(rowid) picks the depreq row the per-PRR fetchone() used to see first
+	cmd = '''select prr.id,prr.request_date_year,prr.request_date_epoch,prr.closed_date_epoch,
+				prr.closure_reasons,prr.prr_state,dr.department_id,dc.ndoc,dc.nredact
+			from prr
+			left join (select request_id,department_id,min(rowid) from depreq group by request_id) dr
+				on dr.request_id=prr.id
+			left join (select request_id,count(*) as ndoc,
+						sum(instr(lower(title),'redact')=0) as nredact
+					from document group by request_id) dc
+				on dc.request_id=prr.id
+			order by prr.rowid'''
 	curs.execute(cmd)
-	allPRR = curs.fetchall()
 
-	print(f'anlyzRedact: NPRR={len(allPRR)}')
+	deptTbl = defaultdict(lambda: defaultdict(lambda: {'nprr': 0,'nclose':0})) # deptNormName -> year {info}
+	deptFirstYear = {}
 
-	deptTbl = {} # deptNormName -> year {info}
+	# one entry per CLOSED PRR
+	closeCols = {'dept': [], 'year': [], 'ndoc': [], 'fracRedact': [],
+				 'closeDays': [], 'redact': []}
 	
+	nprr = 0
 	nmissdept = 0
 	nmissRedactPRR = 0
-	allYears = [2018,2019,2020]
+	allYears = set()
 	
-	allCloseReason = set()
-	for prr in allPRR:
-		(prrIdx,pretty_id,request_date,created_at,closed_date,closure_reasons,prr_state) = prr
-		reqDate = datetime.datetime.strptime(request_date,NRDTformat)
-
-		prrYear = reqDate.year
+	for prr in metricIter('query',curs):
+		(prrIdx,prrYear,reqEpoch,closeEpoch,closure_reasons,prr_state,deptIdx,ndoc,nredact) = prr
+		nprr += 1
 
-		cmd = 'select department_id from depreq where request_id=?'
-		curs.execute(cmd,(prrIdx,))
-		deptIdx = curs.fetchone()
-		
 		if deptIdx == None:
 			nmissdept += 1
 			continue
 		
-		deptIdx = deptIdx[0]
-
-		cmd = 'select name from department where id=?'
-		curs.execute(cmd,(deptIdx,))
-		deptName = curs.fetchone()
-	
-		if deptName == None:
+		if deptIdx not in normDeptTbl:
 			print(f'anlyzDeptClearance: missing deptName deptIdx={deptIdx}?!')
 			nmissdept += 1
 			continue
 		
-		deptName = deptName[0]
-		normDept = normalizeDeptName(deptName)
+		normDept = normDeptTbl[deptIdx]
+		allYears.add(prrYear)
 
-		if normDept not in deptTbl:
-			deptTbl[normDept] = {}
-			for y in allYears:
-				deptTbl[normDept][y] = {'nprr': 1,'nclose':0, 'ndoc': [], 'fracRedact': [], 'closeDays': [], 'rcloseDays': []}
-		else:
-			deptTbl[normDept][prrYear]['nprr'] += 1
+		if normDept not in deptFirstYear:
+			deptFirstYear[normDept] = prrYear
+		deptTbl[normDept][prrYear]['nprr'] += 1
 
 		if prr_state != 'Closed':
 			continue
@@ -812,121 +2982,125 @@ def anlyzRedact(currDB,outdir):
 		else:
 			prrRedact = False
 
-		closeDate = datetime.datetime.strptime(closed_date,NRDTformat)
-		closeDays = (closeDate - reqDate).days
-		
-		cmd = 'select id,title from document where request_id=?'
-		curs.execute(cmd,(prrIdx,))
-		docRows = curs.fetchall()
-		ndoc = len(docRows)
-		deptTbl[normDept][prrYear]['ndoc'].append(ndoc)
-		
-		nredact = 0
-		for doc in docRows:
-			(id,title) = doc
-			if title.lower().find('redact') == -1:
-				nredact += 1
+		ndoc = ndoc if ndoc != None else 0
+		nredact = nredact if nredact != None else 0
 
 		if nredact>0 and not prrRedact:
 			nmissRedactPRR += 1
 			
 		fracRedact = float(nredact) / ndoc if ndoc>0 else 0.
-		deptTbl[normDept][prrYear]['fracRedact'].append(fracRedact)
 		
-		if nredact>0: # or prrRedact:
-			deptTbl[normDept][prrYear]['rcloseDays'].append(closeDays)
-		else:
-			deptTbl[normDept][prrYear]['closeDays'].append(closeDays)
+		# NB: floor division matches timedelta.days
+		closeDays = (closeEpoch - reqEpoch) // 86400 if closeEpoch != None else None
 
+		closeCols['dept'].append(normDept)
+		closeCols['year'].append(prrYear)
+		closeCols['ndoc'].append(ndoc)
+		closeCols['fracRedact'].append(fracRedact)
+		closeCols['closeDays'].append(closeDays)
+		closeCols['redact'].append(nredact>0) # or prrRedact
+
+	print(f'anlyzRedact: NPRR={nprr}')
 	print(f'anlyzRedact: NMissRedactPRR={nmissRedactPRR}')
+	metricCounts({'nprr': nprr, 'nmissdept': nmissdept, 'nclose': len(closeCols['dept'])})
 	
+	with metricStage('stats'):
+		keyCols = [closeCols['dept'],closeCols['year']]
+		ndocStats = groupStats(keyCols,closeCols['ndoc'])
+		fracStats = groupStats(keyCols,closeCols['fracRedact'])
+
+		hasDays = [i for i,cd in enumerate(closeCols['closeDays']) if cd != None]
+		dayKeyCols = [[col[i] for i in hasDays] for col in (closeCols['dept'],closeCols['year'],closeCols['redact'])]
+		dayStats = groupStats(dayKeyCols,[closeCols['closeDays'][i] for i in hasDays])
+
 	allDept = sorted(list(deptTbl.keys()))
-	allCR = sorted(list(allCloseReason))
 	
-	for year in allYears:
+	for year in sorted(allYears):
 		outf = outdir + f'deptRedact_{year}.csv'
 		outs = open(outf,'w')
 			
 		hdr = 'Dept,NPRR,NClose,AvgNDoc,AvgFracRedact,AvgCloseDay,AvgRedactDay'
+		hdr += ',MedCloseDay,P90CloseDay,MedRedactDay,P90RedactDay'
 		outs.write(hdr+'\n')
 		for dept in allDept:
 			info = deptTbl[dept][year]
-			avgNDoc,sd = basicStats(info['ndoc'])
-			avgFrac,sd = basicStats(info['fracRedact'])
-			avgCloseDays,sd = basicStats(info['closeDays'])
-			avgRedactDays,sd = basicStats(info['rcloseDays'])
-			line = f'{dept},{info["nprr"]},{info["nclose"]},{avgNDoc},{avgFrac},{avgCloseDays},{avgRedactDays}'
+			# NB: original per-PRR loop seeded nprr=1 in every year on a dept's first PRR
+			deptNPRR = info['nprr'] + (0 if year == deptFirstYear[dept] else 1)
+			avgNDoc = ndocStats.get((dept,year),EmptyStats)['mean']
+			avgFrac = fracStats.get((dept,year),EmptyStats)['mean']
+			closeStats = dayStats.get((dept,year,False),EmptyStats)
+			redactStats = dayStats.get((dept,year,True),EmptyStats)
+			line = f'{dept},{deptNPRR},{info["nclose"]},{avgNDoc},{avgFrac},{closeStats["mean"]},{redactStats["mean"]}'
+			line += f',{closeStats["p50"]},{closeStats["p90"]},{redactStats["p50"]},{redactStats["p90"]}'
 			outs.write(line+'\n')
 			
 		outs.close()
 
+# 210427: compdb2csv mismatches, one row per (pretty_id,diff_type)
+Db2csvDiffTbl = 'db2csv_diff'
+Db2csvDiffTypes = ['missCSV','missDB','dupDB','dupCSV','deptDiff']
+
+@metricFn
 def compdb2csv(currDB,prrCSVTbl,outf):
 	'''210416: compare 210326 API database against 210322 CSV data
+	210427: hash join on pretty_id: DB side bulk loaded in one ordered query,
+			CSV side is prrCSVTbl.  Mismatches (Db2csvDiffTypes) written to
+			Db2csvDiffTbl in currDB rather than printed
+	210505: prrCSVTbl may also be a record stream (eg iterIndexTblCSV): CSV
+			records are then probed against the DB side one at a time and never
+			held; repeated CSV ids are reported as dupCSV (first one is used)
 	'''
 
+	addEpochCols(currDB)
+
 	curs = currDB.cursor()
-	cmd = 'select id,pretty_id,request_date,created_at,closed_date,closure_reasons,prr_state from prr'
+
+	cmd = 'select id,name from department'
 	curs.execute(cmd)
-	allPRR = curs.fetchall()
+	normDeptTbl = {deptIdx: normalizeDeptName(name) for deptIdx,name in curs.fetchall()}
+	deptNormalizer().report('compdb2csv')
 
-	print(f'compdb2csv: NPRR={len(allPRR)}')
+	# NB: ALL departments per PRR, in depreq order
+	cmd = '''select prr.id,prr.pretty_id,prr.request_date_year,depreq.department_id
+			from prr left join depreq on depreq.request_id=prr.id
+			order by prr.rowid,depreq.rowid'''
+	curs.execute(cmd)
 
 	deptTbl = defaultdict(lambda: defaultdict(lambda: defaultdict(int))) # deptNormName -> year -> ('db' | 'csv') -> freq
+	diffList = [] # (pretty_id,prr_id,diff_type,db_depts,csv_depts)
 	
+	dbPRRList = [] # (prrIdx,pretty_id,prrYear,dbDeptSet)
 	nmissdept = 0
-	allYears = [2018,2019,2020]
+	allYears = set()
 	
-	fndCSV = set()
-	nmissCSV = 0
-	ndupCSV = 0
-	for prrDB in allPRR:
-		(prrIdx,pretty_id,request_date,created_at,closed_date,closure_reasons,prr_state) = prrDB
-		reqDate = datetime.datetime.strptime(request_date,NRDTformat)
+	with metricStage('query'):
+		dbRows = curs.fetchall()
 
-		prrYear = reqDate.year
+	for prrIdx,prrRows in itertools.groupby(dbRows,key=lambda row: row[0]):
+		prrRows = list(prrRows)
+		(prrIdx,pretty_id,prrYear,deptIdx) = prrRows[0]
+		allYears.add(prrYear)
 
-		cmd = 'select department_id from depreq where request_id=?'
-		curs.execute(cmd,(prrIdx,))
-		
-		# NB: fetching ALL department?!
-		deptIdxList = curs.fetchall()
-		
-		if deptIdxList == None:
-			nmissdept += 1
-			continue
-		
 		deptNameList = []
-		for didx in deptIdxList:
-			deptIdx = didx[0]
+		for row in prrRows:
+			deptIdx = row[3]
+			if deptIdx == None:
+				continue
 
-			cmd = 'select name from department where id=?'
-			curs.execute(cmd,(deptIdx,))
-			deptName = curs.fetchone()
-		
-			if deptName == None:
+			if deptIdx not in normDeptTbl:
 				print(f'compdb2csv: missing deptName deptIdx={deptIdx}?!')
 				nmissdept += 1
 				continue
 			
-			deptName = deptName[0]
-			normDept = normalizeDeptName(deptName)
+			normDept = normDeptTbl[deptIdx]
 			deptNameList.append(normDept)
 	
 			deptTbl[normDept][prrYear]['db'] += 1
 
-		dbDeptSet = set(deptNameList)
-			
-		if pretty_id not in prrCSVTbl:
-			print(f'compdb2csv: missing PRR in CSV? pretty_id={pretty_id}?!')
-			nmissCSV += 1
-			continue
-		
-		if pretty_id in fndCSV:
-			print(f'compdb2csv: dupCSV?! pretty_id={pretty_id}?!')
-			ndupCSV += 1
-			
-		fndCSV.add(pretty_id)
-		prrCSV = prrCSVTbl[pretty_id]
+		dbPRRList.append((prrIdx,pretty_id,prrYear,set(deptNameList)))
+
+	def joinCSV(dbPRR,prrCSV):
+		(prrIdx,pretty_id,prrYear,dbDeptSet) = dbPRR
 		for csvDept in prrCSV['dept']:
 			# NB: csv department names normalized in bldIndexTblCSV()
 			deptTbl[csvDept][prrYear]['csv'] += 1
@@ -934,19 +3108,82 @@ def compdb2csv(currDB,prrCSVTbl,outf):
 		csvDeptSet = set(prrCSV['dept'])
 		
 		if dbDeptSet != csvDeptSet:
-			print(f'compdb2csv: different departments?! prrIdx={prrIdx} pretty_id={pretty_id}')
-			dbDeptList = sorted(list(dbDeptSet))
-			csvDeptList = sorted(list(csvDeptSet))
-			print(f'\tDB:  {dbDeptList}')
-			print(f'\tCSV: {csvDeptList}')
-			print('')
-
-	allCSVset = set(prrCSVTbl.keys())
-	dbMissSet = allCSVset - fndCSV
-		
-	print(f'compdb2csv: NMissDept={nmissdept} NMissCSV={nmissCSV} ndupCSV={ndupCSV} NDBMiss={len(dbMissSet)}')
+			diffList.append((pretty_id,prrIdx,'deptDiff',';'.join(sorted(dbDeptSet)),';'.join(sorted(csvDeptSet))))
+
+	fndCSV = set()
+	nmissCSV = 0
+	ndupCSV = 0
+	ndbMiss = 0
+	if isinstance(prrCSVTbl,Mapping):
+		for dbPRR in dbPRRList:
+			(prrIdx,pretty_id,prrYear,dbDeptSet) = dbPRR
+				
+			if pretty_id not in prrCSVTbl:
+				diffList.append((pretty_id,prrIdx,'missCSV',';'.join(sorted(dbDeptSet)),None))
+				nmissCSV += 1
+				continue
+			
+			if pretty_id in fndCSV:
+				diffList.append((pretty_id,prrIdx,'dupDB',';'.join(sorted(dbDeptSet)),None))
+				ndupCSV += 1
+				
+			fndCSV.add(pretty_id)
+			joinCSV(dbPRR,prrCSVTbl[pretty_id])
+
+		dbMissSet = set(prrCSVTbl.keys()) - fndCSV
+		ndbMiss = len(dbMissSet)
+		for pretty_id in sorted(dbMissSet):
+			diffList.append((pretty_id,None,'missDB',None,';'.join(sorted(set(prrCSVTbl[pretty_id]['dept'])))))
+
+	else:
+		dbIndex = defaultdict(list) # pretty_id -> [dbPRR]
+		for dbPRR in dbPRRList:
+			dbIndex[dbPRR[1]].append(dbPRR)
+
+		for prrCSV in metricIter('csv',prrCSVTbl):
+			pretty_id = prrCSV['id']
+			if pretty_id in fndCSV:
+				diffList.append((pretty_id,None,'dupCSV',None,';'.join(sorted(set(prrCSV['dept'])))))
+				continue
+
+			if pretty_id not in dbIndex:
+				diffList.append((pretty_id,None,'missDB',None,';'.join(sorted(set(prrCSV['dept'])))))
+				ndbMiss += 1
+				continue
+
+			fndCSV.add(pretty_id)
+			for i,dbPRR in enumerate(dbIndex[pretty_id]):
+				if i > 0:
+					diffList.append((pretty_id,dbPRR[0],'dupDB',';'.join(sorted(dbPRR[3])),None))
+					ndupCSV += 1
+				joinCSV(dbPRR,prrCSV)
+
+		for (prrIdx,pretty_id,prrYear,dbDeptSet) in dbPRRList:
+			if pretty_id not in fndCSV:
+				diffList.append((pretty_id,prrIdx,'missCSV',';'.join(sorted(dbDeptSet)),None))
+				nmissCSV += 1
+		
+	print(f'compdb2csv: NPRR={len(dbPRRList)}')
+	print(f'compdb2csv: NMissDept={nmissdept} NMissCSV={nmissCSV} ndupCSV={ndupCSV} NDBMiss={ndbMiss}')
+	metricCounts({'nprr': len(dbPRRList), 'nmissdept': nmissdept, 'nmissCSV': nmissCSV, 'ndupCSV': ndupCSV, 'ndbMiss': ndbMiss})
+
+	with metricStage('insert'):
+		curs.execute('begin')
+		curs.execute(f'drop table if exists {Db2csvDiffTbl}')
+		cmd = f'create table {Db2csvDiffTbl} (pretty_id TEXT, prr_id INTEGER, diff_type TEXT, db_depts TEXT, csv_depts TEXT)'
+		curs.execute(cmd)
+		cmd = f'insert into {Db2csvDiffTbl} (pretty_id,prr_id,diff_type,db_depts,csv_depts) values (?,?,?,?,?)'
+		curs.executemany(cmd,diffList)
+		curs.execute(f'create index {Db2csvDiffTbl}_typeIdx on {Db2csvDiffTbl}(diff_type)')
+		curs.execute('commit')
+
+	diffCount = defaultdict(int)
+	for diff in diffList:
+		diffCount[diff[2]] += 1
+	print(f'compdb2csv: {Db2csvDiffTbl} '+' '.join([f'{dtype}={diffCount[dtype]}' for dtype in Db2csvDiffTypes]))
 	
 	allDept = sorted(list(deptTbl.keys()))
+	allYears = sorted(allYears)
 	outs = open(outf,'w')	
 	hdr = 'Dept'
 	for year in allYears:
@@ -966,14 +3203,19 @@ if __name__ == '__main__':
 	dataDir = 'PATH-TO-DATAD/'
 
 	# 210407: Restrict analysis to > Apr 1 2018
-	startDate = datetime.datetime(2018,4,1,tzinfo=OaklandTimeZone)
-	endDate =   datetime.datetime(2021,1,1,tzinfo=OaklandTimeZone)
+	startDate = OaklandTimeZone.localize(datetime.datetime(2018,4,1))
+	endDate =   OaklandTimeZone.localize(datetime.datetime(2021,1,1))
 	
 	# 210415: use SD's updated table
 	deptFile_SD = dataDir + 'sdoran-DeptLookup-emdash-v2.csv'
 	global DeptTbl_SD
 	DeptTbl_SD = loadDept_SD(deptFile_SD)
 
+	# 210510: OAKPRR_METRICS=metrics.json (+ OAKPRR_PROFILE=run.prof) instruments this run
+	if 'OAKPRR_METRICS' in os.environ:
+		startMetrics(os.environ['OAKPRR_METRICS'],os.environ.get('OAKPRR_PROFILE'))
+		atexit.register(stopMetrics)
+
 	## 210330: work from SD's downloaded json
 	jsonDir = dataDir + 'API_data/'
 	
@@ -989,10 +3231,15 @@ if __name__ == '__main__':
 	## 210416: compare 210326 API data against 210322 CSV data
 	
 	csvFile = dataDir + 'requests-2021-03-22 redacted.csv'
-	prrCSV = bldIndexTblCSV(csvFile,startDate,endDate)
+	# 210505: stream CSV records into the join; bldIndexTblCSV() for a cached table
+	prrCSV = iterIndexTblCSV(csvFile,startDate,endDate)
 
 	compFile = dataDir + 'db2csvComp.csv'
 	compdb2csv(currDB,prrCSV,compFile)
+
+	## 210513: requester companies from CSV, linked to DB PRR
+	bldRequesterTbl(currDB,iterIndexTblCSV(csvFile,startDate,endDate))
+	rptRequesters(currDB,dataDir + 'topRequesters.csv')
 	
 
 